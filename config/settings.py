@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "debug_toolbar.middleware.DebugToolbarMiddleware",
+    'store.metrics.MetricsMiddleware',
+    'store.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,6 +100,30 @@ DATABASES = {
     }
 }
 
+# GET/HEAD requests to the store API read from one of these DATABASES aliases (e.g. 'replica1').
+# A client that wrote reads from the primary for STORE_REPLICA_STICKY_SECONDS afterwards,
+# which needs a cache shared by all workers when there are several.
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+STORE_READ_REPLICAS = []
+STORE_REPLICA_STICKY_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Cached responses, category counts, cart summaries and currency rates are invalidated by
+# bumping version keys in this cache, which only reaches the workers that share it.
+# LocMemCache is kept by each process, so with several workers a write leaves the others
+# serving stale responses for up to RESPONSE_CACHE_TIMEOUT and stale category counts for up
+# to an hour. Use a shared backend (Redis, Memcached or the database cache) whenever more
+# than one worker runs.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'store',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -143,9 +169,18 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT', ),
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=1)
+    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
 }
 
+# Seconds an authenticated user stays cached; saving the user drops it sooner.
+AUTH_USER_CACHE_TIMEOUT = 60
+# Authenticate from the claims signed into tokens (username, is_staff, is_superuser) without
+# reading the user. Nothing but the token is checked then: deactivating a user, changing their
+# password (CHECK_REVOKE_TOKEN) or their staff rights only takes effect when the access token
+# expires, up to ACCESS_TOKEN_LIFETIME later. Only turn it on with short-lived access tokens.
+AUTH_TRUST_TOKEN_CLAIMS = False
+
 DJOSER = {
     'SERIALIZERS': {
         'user_create': 'core.serializers.UserCreateSerializer',
@@ -159,7 +194,19 @@ AUTH_USER_MODEL = 'core.CustomUser'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     )
 }
 
+
+# Cart storage: 'store.carts.DatabaseCartStore' writes through to the database,
+# 'store.carts.CacheCartStore' keeps carts in the cache and writes them back in batches.
+STORE_CART_BACKEND = 'store.carts.DatabaseCartStore'
+STORE_CART_OPTIONS = {}
+# Seconds without a write after which reap_carts deletes a cart (empty carts go sooner).
+STORE_CART_TTL = 60 * 60 * 24 * 30
+STORE_EMPTY_CART_TTL = 60 * 60 * 24
+
+# Currency rates are kept in each process and reloaded when a rate changes, which only
+# reaches processes sharing the cache; this bounds how old they get otherwise.
+STORE_CURRENCY_RATES_MAX_AGE = 60
@@ -0,0 +1,28 @@
+"""
+Settings for the test suite, which runs on SQLite so it needs no MySQL server:
+
+    python manage.py test --settings=config.test_settings
+"""
+from .settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # Under test the replicas mirror the default database, so ReplicaRouter's routing can be checked.
+    'replica1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+    'replica2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+STORE_READ_REPLICAS = ['replica1', 'replica2']
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from store.metrics import metrics_view
+
 admin.site.site_header = 'Store'
 admin.site.index_title = 'Special Access'
 
@@ -25,5 +27,6 @@ urlpatterns = [
     path('store/', include('store.urls')),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
+    path('metrics', metrics_view, name='metrics'),
     path("__debug__/", include("debug_toolbar.urls")),
 ]
@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from store.replicas import use_primary
+from .models import CustomUser
+
+USER_CACHE_KEY = 'core:user:{}'
+DEFAULT_USER_CACHE_TIMEOUT = 60
+
+# Claims TokenObtainPairSerializer signs into tokens; ClaimsUser answers these without loading the user.
+USER_CLAIMS = ['username', 'is_staff', 'is_superuser']
+
+
+def get_user_cache_timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', DEFAULT_USER_CACHE_TIMEOUT)
+
+
+def get_cached_user(user_id):
+    """The user with `user_id` (None if there is none), cached for AUTH_USER_CACHE_TIMEOUT seconds."""
+    key = USER_CACHE_KEY.format(user_id)
+    user = cache.get(key)
+    if user is None:
+        with use_primary():
+            user = CustomUser.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is not None:
+            cache.set(key, user, get_user_cache_timeout())
+    return user
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(USER_CACHE_KEY.format(user_id))
+
+
+class ClaimsUser(TokenUser):
+    """
+    A user answered from the token's signed claims. Anything the claims do not carry,
+    including permission checks and writes, goes to the real (cached) user, which is
+    only loaded when first needed.
+    """
+    _own_attributes = {'token', 'user'}
+
+    @cached_property
+    def user(self):
+        user = get_cached_user(self.id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        return user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own_attributes:
+            super().__setattr__(name, value)
+        else:
+            setattr(self.user, name, value)
+
+    @property
+    def groups(self):
+        return self.user.groups
+
+    @property
+    def user_permissions(self):
+        return self.user.user_permissions
+
+    def get_group_permissions(self, obj=None):
+        return self.user.get_group_permissions(obj)
+
+    def get_all_permissions(self, obj=None):
+        return self.user.get_all_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        return self.user.has_perm(perm, obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return self.user.has_perms(perm_list, obj)
+
+    def has_module_perms(self, module):
+        return self.user.has_module_perms(module)
+
+    def save(self, *args, **kwargs):
+        self.user.save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self.user.delete(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        self.user.set_password(raw_password)
+
+    def check_password(self, raw_password):
+        return self.user.check_password(raw_password)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that reads the user from a short-lived cache (invalidated when
+    the user is saved) instead of the database on every request. With
+    AUTH_TRUST_TOKEN_CLAIMS the user is built from the token's signed claims and
+    neither the cache nor the database is read unless something beyond them is
+    needed. The token is then all that is checked: a deactivated user, a password
+    change (CHECK_REVOKE_TOKEN) and a change to is_staff or is_superuser only take
+    effect once the access token expires.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        if getattr(settings, 'AUTH_TRUST_TOKEN_CLAIMS', False):
+            return ClaimsUser(validated_token)
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
@@ -1,3 +1,58 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .authentication import ClaimsUser
+from .models import CustomUser
+from .serializers import TokenObtainPairSerializer
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='secret')
+        self.client = APIClient(REMOTE_ADDR='192.0.2.1')
+        token = TokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def me(self):
+        return self.client.get('/store/customers/me/')
+
+    def test_user_is_read_from_cache(self):
+        self.assertEqual(self.me().status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me().status_code, 200)
+
+    def test_saving_the_user_invalidates_the_cache(self):
+        self.me()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.me().status_code, 401)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_claims_user_comes_from_the_token(self):
+        response = self.me()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.wsgi_request.user, ClaimsUser)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_claims_mode_skips_the_user_lookup(self):
+        with mock.patch('core.authentication.get_cached_user') as get_cached_user:
+            self.assertEqual(self.client.get('/store/products/').status_code, 200)
+        get_cached_user.assert_not_called()
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_claims_mode_trusts_the_token_until_it_expires(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.clear()
+        self.assertEqual(self.client.get('/store/products/').status_code, 200)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_claims_mode_keeps_signed_staff_claim(self):
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        cache.clear()
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
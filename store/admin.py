@@ -1,10 +1,94 @@
+import math
+
 from django.contrib import admin, messages
-from django.db.models import Count
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections, transaction
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.utils.http import urlencode
+from django.utils import timezone
 
 from . import models
+from .cache import bump_resource_version, PRODUCTS, CATEGORIES
+from .exports import export_orders, export_products
+
+
+def estimate_row_count(model, using):
+    """Row count of the model's table from the database statistics, or None where there are none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts an unfiltered changelist from the table statistics and a filtered one up to
+    `count_limit` rows, so a page never waits on an exact COUNT(*) over a large table.
+    Past such a count the last page is unknown, so every page number stays reachable
+    and the page after the current one is always offered.
+    """
+    count_limit = 10000
+    current_page = 0
+
+    @cached_property
+    def counted(self):
+        """(count, whether the count is exact)"""
+        queryset = self.object_list.order_by()
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.count_limit:
+                return estimate, False
+        count = queryset.values('pk')[:self.count_limit].count()
+        return count, count < self.count_limit
+
+    @property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def count_is_exact(self):
+        return self.counted[1]
+
+    @property
+    def num_pages(self):
+        num_pages = math.ceil(max(1, self.count - self.orphans) / self.per_page)
+        if not self.count_is_exact:
+            num_pages = max(num_pages, self.current_page + 1)
+        return num_pages
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        if self.count_is_exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        self.current_page = number
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -31,25 +115,18 @@ class InventoryFilter(admin.SimpleListFilter):
 
 
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'name', 'inventory', 'unit_price', 'inventory_status', 'product_category', 'num_of_comments']
     list_per_page = 10
     list_editable = ['unit_price']
-    list_select_related = ['category']
+    list_select_related = ['category', 'comment_stats']
     list_filter = ['datetime_created', InventoryFilter]
-    actions = ['clear_inventory']
+    actions = ['clear_inventory', 'export_csv', 'export_ndjson']
     search_fields = ['name', ]
     prepopulated_fields = {
         'slug': ['name', ]
     }
 
-    def get_queryset(self, request):
-        return super().get_queryset(request) \
-                .prefetch_related('comments') \
-                .annotate(
-                    comments_count=Count('comments'),
-                )
-
     def inventory_status(self, product):
         if product.inventory < 10:
             return 'Low'
@@ -57,8 +134,9 @@ class ProductAdmin(admin.ModelAdmin):
             return 'High'
         return 'Medium'
 
-    @admin.display(description='# comments', ordering='comments_count')
+    @admin.display(description='# comments (pending)', ordering='comment_stats__approved_count')
     def num_of_comments(self, product):
+        stats = getattr(product, 'comment_stats', None) or models.ProductCommentStats()
         url = (
             reverse('admin:store_comment_changelist')
             + '?'
@@ -66,7 +144,7 @@ class ProductAdmin(admin.ModelAdmin):
                 'product__id': product.id,
             })
         )
-        return format_html('<a href="{}">{}</a>', url, product.comments_count)
+        return format_html('<a href="{}">{} ({})</a>', url, stats.approved_count, stats.pending_count)
 
     @admin.display(ordering='category__title')
     def product_category(self, product):
@@ -74,19 +152,30 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
-        update_count = queryset.update(inventory=0)
+        update_count = queryset.update(inventory=0, datetime_modified=timezone.now())
+        # A queryset update sends no post_save, so cached product reads are dropped here.
+        transaction.on_commit(lambda: bump_resource_version(PRODUCTS, CATEGORIES))
         self.message_user(
             request,
             f'{update_count} of products inventories cleared to zero.',
             messages.ERROR,
         )
 
+    @admin.action(description='Export as CSV')
+    def export_csv(self, request, queryset):
+        return export_products(queryset, 'csv')
+
+    @admin.action(description='Export as NDJSON')
+    def export_ndjson(self, request, queryset):
+        return export_products(queryset, 'ndjson')
+
 
 @admin.register(models.Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'product', 'status', ]
     list_editable = ['status']
     list_per_page = 10
+    list_select_related = ['product']
     autocomplete_fields = ['product', ]
 
 
@@ -98,33 +187,36 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'customer', 'status', 'datetime_created', 'num_of_items']
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ['id', 'customer', 'status', 'datetime_created', 'items_count', 'total_amount']
     list_editable = ['status']
     list_per_page = 10
+    list_filter = ['status', 'datetime_created']
     ordering = ['-datetime_created']
+    readonly_fields = ['items_count', 'total_amount']
     inlines = [OrderItemInline]
+    actions = ['export_csv', 'export_ndjson']
 
     def get_queryset(self, request):
-        return super() \
-                .get_queryset(request) \
-                .prefetch_related('items') \
-                .annotate(
-                    items_count=Count('items')
-                )
+        return super().get_queryset(request).select_related('customer__user')
+
+    @admin.action(description='Export as CSV')
+    def export_csv(self, request, queryset):
+        return export_orders(queryset, 'csv')
 
-    @admin.display(ordering='items_count', description='# items')
-    def num_of_items(self, order):
-        return order.items_count
+    @admin.action(description='Export as NDJSON')
+    def export_ndjson(self, request, queryset):
+        return export_orders(queryset, 'ndjson')
 
 
 admin.site.register(models.Category)
 
 
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['first_name', 'last_name', 'email', ]
     list_per_page = 10
+    list_select_related = ['user']
     ordering = ['user__last_name', 'user__first_name', ]
     search_fields = ['user__first_name__istartswith', 'user__last_name__istartswith', ]
 
@@ -139,8 +231,9 @@ class CustomerAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'unit_price']
+    list_select_related = ['order', 'product']
     autocomplete_fields = ['product', ]
 
 
@@ -152,12 +245,41 @@ class CartItemInline(admin.TabularInline):
 
 
 @admin.register(models.Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'created_at']
     inlines = [CartItemInline]
 
 
 @admin.register(models.CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'product', 'cart', 'quantity']
+    list_select_related = ['product', 'cart']
 
+
+@admin.register(models.OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event', 'status', 'attempts', 'available_at', 'datetime_created', 'datetime_processed']
+    list_filter = ['status', 'event']
+    list_per_page = 10
+    readonly_fields = ['datetime_created', 'datetime_processed']
+    actions = ['requeue']
+
+    @admin.action(description='Requeue events')
+    def requeue(self, request, queryset):
+        update_count = queryset.exclude(status=models.OutboxEvent.EVENT_STATUS_PENDING).update(
+            status=models.OutboxEvent.EVENT_STATUS_PENDING,
+            attempts=0,
+            available_at=timezone.now(),
+        )
+        self.message_user(
+            request,
+            f'{update_count} of events requeued.',
+            messages.SUCCESS,
+        )
+
+
+@admin.register(models.CurrencyRate)
+class CurrencyRateAdmin(admin.ModelAdmin):
+    list_display = ['code', 'rate', 'decimal_places', 'datetime_modified']
+    list_editable = ['rate']
+    list_per_page = 10
@@ -0,0 +1,123 @@
+"""
+Async versions of the hottest catalog reads, for deployments served by `config.asgi`.
+They use the async ORM and return the same payloads as ProductModelViewSet and
+CategoryModelViewSet. Anything beyond the plain request shapes handled here
+(filters, search, ordering, cursors, currencies, credentials, conditional or
+browsable API requests) is handed to the sync viewset, so behaviour never forks.
+"""
+import math
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import aget_category_product_counts, abuild_response_cache_key, RESPONSE_CACHE_TIMEOUT, PRODUCTS, CATEGORIES
+from .currencies import aget_rates
+from .fast_serializers import ValuesRowSerializer
+from .models import Category, Product
+from .paginations import ProductPagination
+from .replicas import use_primary
+from .renderers import dumps
+from .serializers import CategorySerializer, ProductSerializer
+from .views import CategoryModelViewSet, ProductModelViewSet
+
+sync_product_list = ProductModelViewSet.as_view({'get': 'list'})
+sync_product_detail = ProductModelViewSet.as_view({'get': 'retrieve'})
+sync_category_list = CategoryModelViewSet.as_view({'get': 'list'})
+
+DELEGATED_HEADERS = ['HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE']
+
+
+def can_serve_async(request, query_params=()):
+    if any(header in request.META for header in DELEGATED_HEADERS):
+        return False
+    if 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+        return False
+    return all(param in query_params for param in request.GET)
+
+
+def json_response(data):
+    return HttpResponse(dumps(data), content_type='application/json')
+
+
+async def cached(resource, request, build):
+    # Keyed like CachedReadMixin on the resource version, so the same writes invalidate
+    # them; the key includes the path, so these entries are separate from the sync views'.
+    key = await abuild_response_cache_key(resource, request)
+    data = await cache.aget(key)
+    if data is None:
+        with use_primary():
+            data = await build()
+        if data is not None:
+            await cache.aset(key, data, RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+async def build_product_page(request):
+    """The page ProductPagination returns, or None for anything but an existing page number."""
+    pagination = ProductPagination
+    try:
+        page_number = int(request.GET.get(pagination.page_query_param, 1))
+    except ValueError:
+        return None
+    queryset = Product.objects.select_related('category').order_by('id')
+    count = await queryset.acount()
+    num_pages = max(1, math.ceil(count / pagination.page_size))
+    if not 1 <= page_number <= num_pages:
+        return None
+
+    row_serializer = ValuesRowSerializer(ProductSerializer(context={'currency': '', 'rates': await aget_rates()}))
+    offset = (page_number - 1) * pagination.page_size
+    rows = row_serializer.get_rows(queryset)[offset:offset + pagination.page_size]
+    page = [row async for row in rows.aiterator()]
+
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, pagination.page_query_param, page_number + 1) if page_number < num_pages else None
+    if page_number == 1:
+        previous_link = None
+    elif page_number == 2:
+        previous_link = remove_query_param(url, pagination.page_query_param)
+    else:
+        previous_link = replace_query_param(url, pagination.page_query_param, page_number - 1)
+    return {'count': count, 'next': next_link, 'previous': previous_link, 'results': row_serializer.serialize(page)}
+
+
+async def build_product(pk):
+    try:
+        product = await Product.objects.select_related('category').aget(pk=pk)
+    except Product.DoesNotExist:
+        return None
+    return ProductSerializer(product, context={'currency': '', 'rates': await aget_rates()}).data
+
+
+async def build_categories():
+    context = {'product_counts': await aget_category_product_counts()}
+    categories = [category async for category in Category.objects.all()]
+    return CategorySerializer(categories, many=True, context=context).data
+
+
+@require_GET
+async def product_list(request):
+    if can_serve_async(request, [ProductPagination.page_query_param]):
+        data = await cached(PRODUCTS, request, lambda: build_product_page(request))
+        if data is not None:
+            return json_response(data)
+    return await sync_to_async(sync_product_list)(request)
+
+
+@require_GET
+async def product_detail(request, pk):
+    if can_serve_async(request):
+        data = await cached(PRODUCTS, request, lambda: build_product(pk))
+        if data is not None:
+            return json_response(data)
+    return await sync_to_async(sync_product_detail)(request, pk=pk)
+
+
+@require_GET
+async def category_list(request):
+    if can_serve_async(request):
+        return json_response(await cached(CATEGORIES, request, build_categories))
+    return await sync_to_async(sync_category_list)(request)
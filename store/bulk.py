@@ -0,0 +1,180 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework import serializers
+
+from .cache import invalidate_product_caches
+from .models import Category, Product
+from .search import index_products
+from .serializers import BulkProductSerializer, InventoryDeltaSerializer
+
+BULK_BATCH_SIZE = 500
+BULK_MAX_ROWS = 10000
+
+
+def validate_rows(data):
+    if not isinstance(data, list):
+        raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+    if len(data) > BULK_MAX_ROWS:
+        raise serializers.ValidationError({'non_field_errors': [f'At most {BULK_MAX_ROWS} items per request.']})
+    return data
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def batched(items, size=BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_create_products(products):
+    """bulk_create in batches, with every product getting its id back on any backend."""
+    for batch in batched(products):
+        Product.objects.bulk_create(batch)
+        if batch[0].pk is None:
+            set_created_ids(batch)
+
+
+def set_created_ids(batch):
+    # MySQL returns no ids from a multi-row INSERT, so the rows are selected again by the
+    # slug and creation time bulk_create gave each instance. Rows that tie on both keep
+    # their order, as one INSERT numbers its rows in the order they are listed.
+    ids = defaultdict(list)
+    created = [product.datetime_created for product in batch]
+    rows = Product.objects.filter(
+        slug__in={product.slug for product in batch},
+        datetime_created__range=(min(created), max(created)),
+    ).order_by('id').values_list('id', 'slug', 'datetime_created')
+    for product_id, slug, datetime_created in rows:
+        ids[slug, datetime_created].append(product_id)
+    for product in batch:
+        product.pk = ids[product.slug, product.datetime_created].pop(0)
+
+
+def error_result(index, errors):
+    return {'index': index, 'status': 'error', 'errors': errors}
+
+
+def summarize(results):
+    results = [results[index] for index in sorted(results)]
+    counts = defaultdict(int)
+    for result in results:
+        counts[result['status']] += 1
+    return {**counts, 'results': results}
+
+
+def bulk_save_products(rows):
+    """
+    Create the rows without an `id` and partially update the others. Every row is
+    validated first (categories and instances are loaded in one query each); valid
+    rows are then written in batches and each row gets its own result.
+    """
+    rows = validate_rows(rows)
+    dict_rows = [row for row in rows if isinstance(row, dict)]
+    product_ids = {parse_int(row['id']) for row in dict_rows if 'id' in row} - {None}
+    category_ids = {parse_int(row.get('category')) for row in dict_rows} - {None}
+    instances = Product.objects.in_bulk(product_ids)
+    context = {'category_ids': set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True))}
+    create_serializer = BulkProductSerializer(context=context)
+    update_serializer = BulkProductSerializer(context=context, partial=True)
+
+    results = {}
+    created, updated, updated_fields = [], {}, set()
+    for index, row in enumerate(rows):
+        is_update = isinstance(row, dict) and 'id' in row
+        product_id = parse_int(row['id']) if is_update else None
+        if is_update and product_id not in instances:
+            results[index] = error_result(index, {'id': [f'Invalid pk "{row["id"]}" - object does not exist.']})
+            continue
+        try:
+            attrs = (update_serializer if is_update else create_serializer).run_validation(row)
+        except serializers.ValidationError as exc:
+            results[index] = error_result(index, exc.detail)
+            continue
+        attrs.pop('id', None)
+        if is_update:
+            product = instances[product_id]
+            for field, value in attrs.items():
+                setattr(product, field, value)
+            updated_fields.update(attrs)
+            updated[product_id] = product
+            results[index] = {'index': index, 'status': 'updated', 'id': product_id}
+        else:
+            product = Product(**attrs)
+            product.slug = slugify(product.name)
+            created.append((index, product))
+
+    with transaction.atomic():
+        new_products = [product for _, product in created]
+        bulk_create_products(new_products)
+        if updated:
+            now = timezone.now()
+            for product in updated.values():
+                product.datetime_modified = now
+            Product.objects.bulk_update(
+                list(updated.values()), [*updated_fields, 'datetime_modified'], batch_size=BULK_BATCH_SIZE
+            )
+        index_products([*new_products, *updated.values()])
+        # Bulk writes skip the model signals that normally do this.
+        transaction.on_commit(invalidate_product_caches)
+
+    for index, product in created:
+        results[index] = {'index': index, 'status': 'created', 'id': product.id}
+    return summarize(results)
+
+
+def adjust_inventory(rows):
+    """
+    Apply inventory deltas. Products are locked in primary key order and each row
+    is checked against the running stock, so a row that would take a product below
+    zero fails alone. The accepted deltas are written with set-based F() updates.
+    """
+    rows = validate_rows(rows)
+    serializer = InventoryDeltaSerializer()
+    results = {}
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except serializers.ValidationError as exc:
+            results[index] = error_result(index, exc.detail)
+
+    with transaction.atomic():
+        inventories = {}
+        for batch in batched(sorted({attrs['product'] for _, attrs in valid})):
+            locked_products = Product.objects.select_for_update().filter(id__in=batch).order_by('id')
+            inventories.update(locked_products.values_list('id', 'inventory'))
+
+        deltas = defaultdict(int)
+        for index, attrs in valid:
+            product_id, delta = attrs['product'], attrs['delta']
+            if product_id not in inventories:
+                results[index] = error_result(index, {'product': [f'Invalid pk "{product_id}" - object does not exist.']})
+                continue
+            if inventories[product_id] + delta < 0:
+                results[index] = error_result(index, {'delta': [f'Only {inventories[product_id]} in stock.']})
+                continue
+            inventories[product_id] += delta
+            deltas[product_id] += delta
+            results[index] = {'index': index, 'status': 'updated', 'product': product_id, 'inventory': inventories[product_id]}
+
+        now = timezone.now()
+        for batch in batched([(product_id, delta) for product_id, delta in deltas.items() if delta]):
+            Product.objects.filter(id__in=[product_id for product_id, _ in batch]).update(
+                inventory=Case(
+                    *[When(id=product_id, then=F('inventory') + delta) for product_id, delta in batch],
+                    default=F('inventory'),
+                ),
+                datetime_modified=now,
+            )
+        transaction.on_commit(invalidate_product_caches)
+
+    return summarize(results)
@@ -0,0 +1,168 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils.http import urlencode
+from rest_framework.response import Response
+
+from .models import Product, Cart, Customer
+from .replicas import use_primary
+
+CATEGORY_PRODUCT_COUNTS_KEY = 'store:category_product_counts'
+CATEGORY_PRODUCT_COUNTS_TIMEOUT = 60 * 60
+
+CART_SUMMARY_KEY = 'store:cart_summary:{}:{}'
+CART_SUMMARY_TIMEOUT = 60 * 60
+
+CUSTOMER_KEY = 'store:customer:{}'
+CUSTOMER_TIMEOUT = 60
+
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+RESOURCE_VERSION_KEY = 'store:version:{}'
+RESPONSE_CACHE_KEY = 'store:response:{}:{}:{}'
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+CURRENCIES = 'currencies'
+
+
+def category_product_counts_query():
+    return Product.objects.order_by().values('category_id').annotate(count=Count('id')).values_list('category_id', 'count')
+
+
+def get_category_product_counts():
+    """Return {category_id: number_of_products}, computed with one GROUP BY query and cached."""
+    counts = cache.get(CATEGORY_PRODUCT_COUNTS_KEY)
+    if counts is None:
+        with use_primary():
+            counts = dict(category_product_counts_query())
+        cache.set(CATEGORY_PRODUCT_COUNTS_KEY, counts, CATEGORY_PRODUCT_COUNTS_TIMEOUT)
+    return counts
+
+
+async def aget_category_product_counts():
+    counts = await cache.aget(CATEGORY_PRODUCT_COUNTS_KEY)
+    if counts is None:
+        with use_primary():
+            counts = {category_id: count async for category_id, count in category_product_counts_query()}
+        await cache.aset(CATEGORY_PRODUCT_COUNTS_KEY, counts, CATEGORY_PRODUCT_COUNTS_TIMEOUT)
+    return counts
+
+
+def invalidate_category_product_counts():
+    cache.delete(CATEGORY_PRODUCT_COUNTS_KEY)
+
+
+def invalidate_product_caches():
+    """Drop everything derived from products; run it on commit of any product write."""
+    invalidate_category_product_counts()
+    bump_resource_version(PRODUCTS, CATEGORIES)
+
+
+def get_cart_summary(cart_id):
+    """Return the cart's id, items_count and total_price from one aggregated query, or None if it does not exist."""
+    # Keyed on the products version too, since a price change moves every total.
+    key = CART_SUMMARY_KEY.format(cart_id, get_resource_version(PRODUCTS))
+    summary = cache.get(key)
+    if summary is None:
+        with use_primary():
+            summary = Cart.objects.with_totals().filter(pk=cart_id).values('id', 'items_count', 'total_price').first()
+        if summary is None:
+            return None
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(cart_id):
+    cache.delete(CART_SUMMARY_KEY.format(cart_id, get_resource_version(PRODUCTS)))
+
+
+def get_customer(user_id):
+    """Return the user's Customer, cached briefly; raises Customer.DoesNotExist like a plain get()."""
+    key = CUSTOMER_KEY.format(user_id)
+    customer = cache.get(key)
+    if customer is None:
+        with use_primary():
+            customer = Customer.objects.get(user_id=user_id)
+        cache.set(key, customer, CUSTOMER_TIMEOUT)
+    return customer
+
+
+def invalidate_customer(user_id):
+    cache.delete(CUSTOMER_KEY.format(user_id))
+
+
+def get_resource_version(resource):
+    # Versions start from the clock so that an evicted version key never
+    # falls back to a number whose entries may still be cached.
+    key = RESOURCE_VERSION_KEY.format(resource)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_resource_version(resource):
+    key = RESOURCE_VERSION_KEY.format(resource)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_resource_version(*resources):
+    for resource in resources:
+        key = RESOURCE_VERSION_KEY.format(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def format_response_cache_key(resource, version, request):
+    # request.GET is the query string of both DRF and plain Django requests.
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    raw = f'{request.get_host()}{request.path}?{query}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return RESPONSE_CACHE_KEY.format(resource, version, digest)
+
+
+def build_response_cache_key(resource, request):
+    return format_response_cache_key(resource, get_resource_version(resource), request)
+
+
+async def abuild_response_cache_key(resource, request):
+    return format_response_cache_key(resource, await aget_resource_version(resource), request)
+
+
+class CachedReadMixin:
+    """
+    Read-through cache for list and retrieve. Entries are keyed on the resource
+    version and the query string, so bumping the version invalidates them all.
+    Responses that will be cached are built from the primary.
+    """
+    cache_resource = None
+    cache_timeout = RESPONSE_CACHE_TIMEOUT
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        # The key is taken before the view runs, so a write that lands while the
+        # response is being built only ever poisons the previous version.
+        key = build_response_cache_key(self.cache_resource, request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        with use_primary():
+            response = handler(request, *args, **kwargs)
+        # Streamed responses have no data to keep.
+        if response.status_code == 200 and isinstance(response, Response):
+            cache.set(key, response.data, self.cache_timeout)
+        return response
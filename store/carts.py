@@ -0,0 +1,430 @@
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, PositiveSmallIntegerField, Prefetch, Value, When
+from django.http import Http404
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import Cart, CartItem, Product
+from .cache import get_cart_summary, invalidate_cart_summary
+from .replicas import use_primary
+
+DEFAULT_CART_STORE = 'store.carts.DatabaseCartStore'
+# Seconds without a write after which a cart is deleted by the reap_carts command.
+DEFAULT_CART_TTL = 60 * 60 * 24 * 30
+DEFAULT_EMPTY_CART_TTL = 60 * 60 * 24
+# updated_at is only moved once it is this old, so busy carts do not rewrite its index on every change.
+CART_TOUCH_INTERVAL = 60 * 5
+
+
+class CartLocked(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Cart is being updated, try again.'
+    default_code = 'cart_locked'
+
+
+def get_cart_store():
+    backend = getattr(settings, 'STORE_CART_BACKEND', DEFAULT_CART_STORE)
+    options = getattr(settings, 'STORE_CART_OPTIONS', {})
+    return import_string(backend)(**options)
+
+
+def touch_cart(cart_id, version=None):
+    """Record a change to the cart's items: bump (or set) its version and refresh a stale updated_at."""
+    now = timezone.now()
+    Cart.objects.filter(pk=cart_id).update(
+        version=F('version') + 1 if version is None else version,
+        updated_at=Case(
+            When(updated_at__lt=now - timedelta(seconds=CART_TOUCH_INTERVAL), then=Value(now)),
+            default=F('updated_at'),
+        ),
+    )
+
+
+def get_expired_carts(now=None):
+    """Carts past their TTL: carts with items by STORE_CART_TTL, empty ones by STORE_EMPTY_CART_TTL."""
+    now = now or timezone.now()
+    ttl = getattr(settings, 'STORE_CART_TTL', DEFAULT_CART_TTL)
+    empty_ttl = getattr(settings, 'STORE_EMPTY_CART_TTL', DEFAULT_EMPTY_CART_TTL)
+    return [
+        Cart.objects.filter(updated_at__lt=now - timedelta(seconds=ttl)),
+        Cart.objects.filter(updated_at__lt=now - timedelta(seconds=empty_ttl))
+            .exclude(Exists(CartItem.objects.filter(cart_id=OuterRef('pk')))),
+    ]
+
+
+def delete_carts_chunk(expired, chunk_size):
+    """
+    Delete up to `chunk_size` carts of `expired`, oldest first, in one short transaction.
+    Carts locked by a concurrent request are skipped. Returns the number of carts and items deleted.
+    """
+    with transaction.atomic():
+        cart_ids = list(
+            expired.order_by('updated_at').select_for_update(skip_locked=True).values_list('id', flat=True)[:chunk_size]
+        )
+        if not cart_ids:
+            return 0, 0
+        # Raw deletes skip loading every item just to send signals for rows that go away with their cart.
+        items = CartItem.objects.filter(cart_id__in=cart_ids)._raw_delete(CartItem.objects.db)
+        carts = Cart.objects.filter(id__in=cart_ids)._raw_delete(Cart.objects.db)
+
+    store = get_cart_store()
+    for cart_id in cart_ids:
+        store.discard(cart_id)
+        invalidate_cart_summary(cart_id)
+    return carts, items
+
+
+class BaseCartStore:
+    """
+    Storage for carts and their items behind the cart endpoints. Items are returned
+    as CartItem instances (with `total_price` set) so the cart serializers work the
+    same whatever the backend.
+    """
+
+    def create_cart(self):
+        raise NotImplementedError
+
+    def get_cart(self, cart_id):
+        raise NotImplementedError
+
+    def delete_cart(self, cart):
+        raise NotImplementedError
+
+    def list_items(self, cart_id):
+        raise NotImplementedError
+
+    def get_item(self, cart_id, item_id):
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product, quantity):
+        raise NotImplementedError
+
+    def update_item(self, item, quantity):
+        raise NotImplementedError
+
+    def delete_item(self, item):
+        raise NotImplementedError
+
+    def get_summary(self, cart_id):
+        raise NotImplementedError
+
+    def get_version(self, cart_id):
+        """A number that changes whenever the cart's items do, or None if there is no such cart."""
+        raise NotImplementedError
+
+    def flush(self, cart_id):
+        """Persist pending writes of a cart to the database."""
+
+    def flush_all(self):
+        """Persist pending writes of every cart. Returns the number of carts flushed."""
+        return 0
+
+    def discard(self, cart_id):
+        """Forget any state kept for a cart that no longer exists in the database."""
+
+
+class DatabaseCartStore(BaseCartStore):
+    def create_cart(self):
+        return Cart.objects.create()
+
+    def get_cart(self, cart_id):
+        return Cart.objects.with_totals().prefetch_related(
+            Prefetch(
+                'items',
+                queryset=CartItem.objects.with_total_price().select_related('product').all()
+            )
+        ).filter(pk=cart_id).first()
+
+    def delete_cart(self, cart):
+        cart.delete()
+
+    def list_items(self, cart_id):
+        return CartItem.objects.with_total_price().select_related('product').filter(cart_id=cart_id).all()
+
+    def get_item(self, cart_id, item_id):
+        return self.list_items(cart_id).filter(pk=item_id).first()
+
+    def add_item(self, cart_id, product, quantity):
+        try:
+            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product.id)
+            cart_item.quantity += quantity
+            cart_item.save()
+        except CartItem.DoesNotExist:
+            cart_item = CartItem.objects.create(cart_id=cart_id, product=product, quantity=quantity)
+        touch_cart(cart_id)
+        return cart_item
+
+    def update_item(self, item, quantity):
+        item.quantity = quantity
+        item.save()
+        touch_cart(item.cart_id)
+        return item
+
+    def delete_item(self, item):
+        item.delete()
+        touch_cart(item.cart_id)
+
+    def get_summary(self, cart_id):
+        return get_cart_summary(cart_id)
+
+    def get_version(self, cart_id):
+        return Cart.objects.filter(pk=cart_id).values_list('version', flat=True).first()
+
+
+class CacheCartStore(BaseCartStore):
+    """
+    Write-behind cart store. Cart rows are created and deleted synchronously, and so
+    is the item row the first time a product is added, which gives the item the same
+    id as with DatabaseCartStore. Quantity changes and removals only touch the cache
+    and are written back in one batch on checkout, once `flush_interval` seconds have
+    passed since the last write-back, or by the `flush_carts` command. Writes not yet
+    flushed are lost if the cache evicts them.
+    """
+    state_key = 'store:cart_state:{}'
+    lock_key = 'store:cart_lock:{}'
+    # Dirty carts are spread over several sets, each with its own lock, so first writes
+    # to different carts rarely wait on each other.
+    dirty_key = 'store:carts:dirty:{}'
+    dirty_shards = 16
+    lock_timeout = 5
+    lock_attempts = 50
+    lock_wait = 0.02
+
+    def __init__(self, cache_alias='default', flush_interval=60, timeout=60 * 60 * 24 * 7):
+        self.cache = caches[cache_alias]
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+
+    @contextmanager
+    def lock(self, name):
+        key = self.lock_key.format(name)
+        for _ in range(self.lock_attempts):
+            if self.cache.add(key, 1, self.lock_timeout):
+                break
+            time.sleep(self.lock_wait)
+        else:
+            raise CartLocked()
+        try:
+            yield
+        finally:
+            self.cache.delete(key)
+
+    @staticmethod
+    def new_state(created_at, version, rows):
+        """`rows` are the cart's persisted (item_id, product_id, quantity)."""
+        return {
+            'created_at': created_at,
+            'version': version,
+            'items': {product_id: quantity for _, product_id, quantity in rows},
+            'persisted': {product_id: quantity for _, product_id, quantity in rows},
+            'ids': {product_id: item_id for item_id, product_id, _ in rows},
+            'flushed_at': time.time(),
+            'dirty': False,
+        }
+
+    def load_state(self, cart_id):
+        key = self.state_key.format(cart_id)
+        state = self.cache.get(key)
+        if state is None:
+            with use_primary():
+                cart = Cart.objects.filter(pk=cart_id).values('created_at', 'version').first()
+                if cart is None:
+                    return None
+                rows = list(CartItem.objects.filter(cart_id=cart_id).order_by('id').values_list('id', 'product_id', 'quantity'))
+            state = self.new_state(cart['created_at'], cart['version'], rows)
+            self.cache.set(key, state, self.timeout)
+        return state
+
+    def save_state(self, cart_id, state):
+        state['version'] = state.get('version', 0) + 1
+        if not state['dirty']:
+            state['dirty'] = True
+            self.mark_dirty(cart_id)
+        if time.time() - state['flushed_at'] >= self.flush_interval and not self.write_back(cart_id, state):
+            return
+        self.cache.set(self.state_key.format(cart_id), state, self.timeout)
+
+    def get_dirty_shard(self, cart_id):
+        return int(str(cart_id).replace('-', ''), 16) % self.dirty_shards
+
+    def mark_dirty(self, cart_id, dirty=True):
+        shard = self.get_dirty_shard(cart_id)
+        key = self.dirty_key.format(shard)
+        with self.lock(f'dirty:{shard}'):
+            dirty_carts = self.cache.get(key, set())
+            if dirty:
+                dirty_carts.add(str(cart_id))
+            else:
+                dirty_carts.discard(str(cart_id))
+            self.cache.set(key, dirty_carts, None)
+
+    def write_back(self, cart_id, state):
+        """Write the changes since the last write-back; returns False if the cart is gone from the database."""
+        items, persisted, ids = state['items'], state['persisted'], state['ids']
+        changed = {product_id: quantity for product_id, quantity in items.items() if persisted.get(product_id) != quantity}
+        removed = [product_id for product_id in persisted if product_id not in items]
+        if changed or removed:
+            with transaction.atomic():
+                if not Cart.objects.filter(pk=cart_id).exists():
+                    self.discard(cart_id)
+                    return False
+                CartItem.objects.filter(id__in=[ids[product_id] for product_id in removed]).delete()
+                if changed:
+                    CartItem.objects.filter(id__in=[ids[product_id] for product_id in changed]).update(quantity=Case(
+                        *[When(id=ids[product_id], then=Value(quantity)) for product_id, quantity in changed.items()],
+                        default=F('quantity'),
+                        output_field=PositiveSmallIntegerField(),
+                    ))
+                # The row takes the cache's version, so a reload after eviction never reuses one.
+                touch_cart(cart_id, state.get('version'))
+            for product_id in removed:
+                del ids[product_id]
+        state['persisted'] = dict(items)
+        state['flushed_at'] = time.time()
+        if state['dirty']:
+            state['dirty'] = False
+            self.mark_dirty(cart_id, dirty=False)
+        return True
+
+    def build_items(self, cart_id, state):
+        products = Product.objects.only('id', 'name', 'unit_price').in_bulk(list(state['items']))
+        cart_items = []
+        for product_id, quantity in state['items'].items():
+            product = products.get(product_id)
+            if product is None:
+                continue
+            cart_items.append(self.build_item(state['ids'][product_id], cart_id, product, quantity))
+        return cart_items
+
+    @staticmethod
+    def build_item(item_id, cart_id, product, quantity):
+        item = CartItem(id=item_id, cart_id=cart_id, product=product, quantity=quantity)
+        item._state.adding = False
+        item.total_price = quantity * product.unit_price
+        return item
+
+    def create_cart(self):
+        cart = Cart.objects.create()
+        self.cache.set(self.state_key.format(cart.pk), self.new_state(cart.created_at, cart.version, []), self.timeout)
+        return cart
+
+    def get_cart(self, cart_id):
+        state = self.load_state(cart_id)
+        if state is None:
+            return None
+        items = self.build_items(cart_id, state)
+        cart = Cart(id=cart_id, created_at=state['created_at'])
+        cart._state.adding = False
+        cart.items_count = len(items)
+        cart.total_price = sum((item.total_price for item in items), Decimal(0))
+        prefetched_items = CartItem.objects.all()
+        prefetched_items._result_cache = items
+        prefetched_items._prefetch_done = True
+        cart._prefetched_objects_cache = {'items': prefetched_items}
+        return cart
+
+    def delete_cart(self, cart):
+        Cart.objects.filter(pk=cart.pk).delete()
+        self.discard(cart.pk)
+
+    def list_items(self, cart_id):
+        state = self.load_state(cart_id)
+        if state is None:
+            return []
+        return self.build_items(cart_id, state)
+
+    def get_item(self, cart_id, item_id):
+        state = self.load_state(cart_id)
+        if state is None:
+            return None
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return None
+        for product_id, quantity in state['items'].items():
+            if state['ids'][product_id] == item_id:
+                product = Product.objects.only('id', 'name', 'unit_price').filter(pk=product_id).first()
+                return self.build_item(item_id, cart_id, product, quantity) if product is not None else None
+        return None
+
+    def add_item(self, cart_id, product, quantity):
+        with self.lock(cart_id):
+            state = self.load_state(cart_id)
+            if state is None:
+                raise Http404()
+            if product.id not in state['ids']:
+                # The row is written now so the item has its id; later changes are written behind.
+                with transaction.atomic():
+                    if not Cart.objects.filter(pk=cart_id).exists():
+                        self.discard(cart_id)
+                        raise Http404()
+                    item = CartItem.objects.create(cart_id=cart_id, product=product, quantity=quantity)
+                state['ids'][product.id] = item.id
+                state['items'][product.id] = state['persisted'][product.id] = quantity
+            else:
+                state['items'][product.id] = state['items'].get(product.id, 0) + quantity
+            self.save_state(cart_id, state)
+        return self.build_item(state['ids'][product.id], cart_id, product, state['items'][product.id])
+
+    def update_item(self, item, quantity):
+        with self.lock(item.cart_id):
+            state = self.load_state(item.cart_id)
+            if state is None:
+                raise Http404()
+            state['items'][item.product_id] = quantity
+            self.save_state(item.cart_id, state)
+        item.quantity = quantity
+        item.total_price = quantity * item.product.unit_price
+        return item
+
+    def delete_item(self, item):
+        with self.lock(item.cart_id):
+            state = self.load_state(item.cart_id)
+            if state is None:
+                return
+            state['items'].pop(item.product_id, None)
+            self.save_state(item.cart_id, state)
+
+    def get_summary(self, cart_id):
+        cart = self.get_cart(cart_id)
+        if cart is None:
+            return None
+        return {'id': cart.pk, 'items_count': cart.items_count, 'total_price': cart.total_price}
+
+    def get_version(self, cart_id):
+        state = self.load_state(cart_id)
+        return state.get('version') if state is not None else None
+
+    def flush(self, cart_id):
+        with self.lock(cart_id):
+            state = self.cache.get(self.state_key.format(cart_id))
+            if state is None:
+                # Evicted: whatever was pending is gone, so the cart is no longer dirty.
+                self.mark_dirty(cart_id, dirty=False)
+            elif state['dirty'] and self.write_back(cart_id, state):
+                self.cache.set(self.state_key.format(cart_id), state, self.timeout)
+
+    def flush_all(self):
+        flushed = 0
+        for shard in range(self.dirty_shards):
+            dirty_carts = self.cache.get(self.dirty_key.format(shard), set())
+            for cart_id in dirty_carts:
+                self.flush(cart_id)
+            flushed += len(dirty_carts)
+        return flushed
+
+    def discard(self, cart_id):
+        key = self.state_key.format(cart_id)
+        state = self.cache.get(key)
+        self.cache.delete(key)
+        if state is not None and state['dirty']:
+            self.mark_dirty(cart_id, dirty=False)
@@ -0,0 +1,51 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def build_etag(request, parts):
+    """Strong ETag over the validator parts and everything else that shapes the representation."""
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = f'{parts!r}|{request.accepted_renderer.media_type}|{request.path}?{query}'
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for GET handlers wrapped in `conditional_response`.
+    `get_validators` returns `(parts, last_modified)` read without serializing
+    anything: `parts` must change whenever the representation can (version columns,
+    max modified timestamps, resource versions), `last_modified` is a datetime or
+    None. A request whose If-None-Match or If-Modified-Since still matches gets a
+    304 before the handler runs.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        return None
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        parts, last_modified = validators
+        etag = build_etag(request, parts)
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class ConditionalReadMixin(ConditionalGetMixin):
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,78 @@
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+
+from .cache import aget_resource_version, get_resource_version, CURRENCIES
+from .models import CurrencyRate
+from .replicas import use_primary
+
+RIAL = 'IRR'
+DEFAULT_RATES_MAX_AGE = 60
+
+# (version, loaded_at, {code: (rate, decimal_places)}), replaced as a whole so readers never see a partial table.
+_rates = (None, None, {})
+
+
+def get_rates_max_age():
+    return getattr(settings, 'STORE_CURRENCY_RATES_MAX_AGE', DEFAULT_RATES_MAX_AGE)
+
+
+def is_fresh(cached, version):
+    cached_version, loaded_at, _ = cached
+    return cached_version == version and time.monotonic() - loaded_at < get_rates_max_age()
+
+
+def get_rates():
+    """
+    Rates are kept in process memory and reloaded when the currencies version
+    changes, which saving or deleting a CurrencyRate does wherever the cache is
+    shared, or at the latest after STORE_CURRENCY_RATES_MAX_AGE seconds, which
+    bounds how long a process with its own cache keeps serving old rates.
+    """
+    global _rates
+    version = get_resource_version(CURRENCIES)
+    cached = _rates
+    if not is_fresh(cached, version):
+        with use_primary():
+            rates = {
+                code: (rate, decimal_places)
+                for code, rate, decimal_places in CurrencyRate.objects.values_list('code', 'rate', 'decimal_places')
+            }
+        cached = _rates = (version, time.monotonic(), rates)
+    return cached[2]
+
+
+async def aget_rates():
+    global _rates
+    version = await aget_resource_version(CURRENCIES)
+    cached = _rates
+    if not is_fresh(cached, version):
+        with use_primary():
+            rates = {
+                code: (rate, decimal_places)
+                async for code, rate, decimal_places in CurrencyRate.objects.values_list('code', 'rate', 'decimal_places')
+            }
+        cached = _rates = (version, time.monotonic(), rates)
+    return cached[2]
+
+
+class CurrencyConverter:
+    """Converts dollar amounts with one rate, rounding half up to the currency's decimal places."""
+
+    def __init__(self, code, rate, decimal_places):
+        self.code = code
+        self.rate = rate
+        self.quantum = Decimal(1).scaleb(-decimal_places)
+        self.whole = decimal_places == 0
+
+    def convert(self, amount):
+        value = (amount * self.rate).quantize(self.quantum, rounding=ROUND_HALF_UP)
+        return int(value) if self.whole else value
+
+
+def get_converter(code, rates=None):
+    rates = get_rates() if rates is None else rates
+    if code not in rates:
+        return None
+    return CurrencyConverter(code, *rates[code])
@@ -0,0 +1,94 @@
+import csv
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .renderers import dumps
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Export column -> lookup. Orders are exported one row per item.
+ORDER_COLUMNS = {
+    'order_id': 'id',
+    'customer_id': 'customer_id',
+    'status': 'status',
+    'datetime_created': 'datetime_created',
+    'items_count': 'items_count',
+    'total_amount': 'total_amount',
+    'product_id': 'items__product_id',
+    'product_name': 'items__product__name',
+    'quantity': 'items__quantity',
+    'unit_price': 'items__unit_price',
+}
+ORDER_ORDERING = ['id', 'items__id']
+
+PRODUCT_COLUMNS = {
+    'id': 'id',
+    'name': 'name',
+    'slug': 'slug',
+    'unit_price': 'unit_price',
+    'inventory': 'inventory',
+    'category_id': 'category_id',
+    'category_title': 'category__title',
+    'datetime_created': 'datetime_created',
+    'datetime_modified': 'datetime_modified',
+}
+PRODUCT_ORDERING = ['id']
+
+
+class Echo:
+    """File-like object for csv.writer that hands back each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset, columns, ordering, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield values_list rows of every object in `queryset`, batch by batch of primary
+    keys, so memory stays flat and no database needs server-side cursors.
+    """
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    rows = queryset.model.objects.order_by(*ordering).values_list(*columns.values())
+    last_id = None
+    while True:
+        batch = list((ids if last_id is None else ids.filter(pk__gt=last_id))[:batch_size])
+        if not batch:
+            return
+        yield from rows.filter(pk__in=batch)
+        last_id = batch[-1]
+
+
+def iter_csv(columns, rows, batch_size=EXPORT_BATCH_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    while batch := list(islice(rows, batch_size)):
+        yield ''.join(writer.writerow(row) for row in batch)
+
+
+def iter_ndjson(columns, rows, batch_size=EXPORT_BATCH_SIZE):
+    columns = list(columns)
+    while batch := list(islice(rows, batch_size)):
+        yield b''.join(dumps(dict(zip(columns, row))) + b'\n' for row in batch)
+
+
+def export_response(queryset, columns, ordering, export_format, name):
+    rows = iter_rows(queryset, columns, ordering)
+    content = iter_csv(columns, rows) if export_format == 'csv' else iter_ndjson(columns, rows)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+    filename = f'{name}-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def export_orders(queryset, export_format):
+    return export_response(queryset, ORDER_COLUMNS, ORDER_ORDERING, export_format, 'orders')
+
+
+def export_products(queryset, export_format):
+    return export_response(queryset, PRODUCT_COLUMNS, PRODUCT_ORDERING, export_format, 'products')
@@ -0,0 +1,91 @@
+from itertools import islice
+from operator import attrgetter
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .renderers import StreamingListMixin
+
+# Fields whose to_representation returns database values unchanged.
+PASSTHROUGH_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.BooleanField, serializers.FloatField)
+
+
+def is_passthrough(field, model):
+    if isinstance(field, PASSTHROUGH_FIELDS):
+        return True
+    # A decimal column already has the serializer's scale, so quantizing it again changes nothing in the JSON.
+    if isinstance(field, serializers.DecimalField) and not field.normalize_output \
+            and not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        model_field = model._meta.get_field(field.source)
+        return model_field.get_internal_type() == 'DecimalField' and model_field.decimal_places <= field.decimal_places
+    return False
+
+
+def none_or(to_representation, getter):
+    def accessor(row):
+        value = getter(row)
+        return None if value is None else to_representation(value)
+    return accessor
+
+
+class ValuesRowSerializer:
+    """
+    Serialises `values_list(named=True)` rows with the output of a ModelSerializer,
+    without building model instances. Every readable field is compiled once into an
+    accessor; SerializerMethodFields receive the row, which has an attribute for each
+    fetched column.
+    """
+
+    def __init__(self, serializer):
+        self.columns = []
+        self.accessors = []
+        model = serializer.Meta.model
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                accessor = getattr(serializer, field.method_name)
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None and '.' not in field.source:
+                column = model._meta.get_field(field.source).attname
+                self.columns.append(column)
+                accessor = attrgetter(column)
+            elif isinstance(field, serializers.ModelField) or field.source == '*' or '.' in field.source \
+                    or isinstance(field, serializers.BaseSerializer):
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{name} can not be serialised from values.')
+            else:
+                self.columns.append(field.source)
+                accessor = attrgetter(field.source)
+                if not is_passthrough(field, model):
+                    accessor = none_or(field.to_representation, accessor)
+            self.accessors.append((name, accessor))
+
+    def get_rows(self, queryset):
+        # Annotations stay fetched so orderings on them (e.g. search rank) work with keyset pagination.
+        columns = list(dict.fromkeys([*self.columns, *queryset.query.annotations]))
+        return queryset.values_list(*columns, named=True)
+
+    def serialize(self, rows):
+        accessors = self.accessors
+        return [{name: accessor(row) for name, accessor in accessors} for row in rows]
+
+
+class ValuesListMixin(StreamingListMixin):
+    """Opt-in fast `list` for read-only endpoints: rows come from values_list and skip the serializer."""
+
+    def list(self, request, *args, **kwargs):
+        if self.is_streaming(request):
+            return super().list(request, *args, **kwargs)
+        row_serializer = ValuesRowSerializer(self.get_serializer())
+        rows = row_serializer.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(row_serializer.serialize(page))
+        return Response(row_serializer.serialize(rows))
+
+    def iter_serialized(self, queryset):
+        row_serializer = ValuesRowSerializer(self.get_serializer())
+        rows = row_serializer.get_rows(queryset).iterator(chunk_size=self.stream_chunk_size)
+        while chunk := list(islice(rows, self.stream_chunk_size)):
+            yield from row_serializer.serialize(chunk)
@@ -0,0 +1,286 @@
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store.models import Cart, CartItem, Category, Comment, Customer, Order, Product
+
+User = get_user_model()
+
+BENCHMARK_ADMIN = 'bench-admin'
+
+# Most SQL queries a single request of each scenario may run, cold cache included.
+# The command exits with an error when a scenario goes over its budget.
+QUERY_BUDGETS = {
+    'products-list': 3,
+    'products-list-deep-page': 3,
+    'products-list-cursor': 2,
+    'products-list-search': 6,
+    'products-detail': 3,
+    'categories-list': 3,
+    'categories-detail': 3,
+    'comments-list': 1,
+    'carts-create': 3,
+    'carts-detail': 3,
+    'carts-summary': 2,
+    'cart-items-list': 1,
+    'cart-items-create': 4,
+    'customers-list': 2,
+    'customers-me': 2,
+    'orders-list': 4,
+    'orders-list-staff': 3,
+    'orders-detail': 4,
+    'orders-create': 18,
+}
+
+
+def percentile(values, percent):
+    # Nearest-rank percentile.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'mean': statistics.fmean(values),
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+class Scenario:
+    """
+    One request against one endpoint. `setup` runs before each request, outside the timing.
+    Scenarios that write to the database, in the request or in `setup`, set `writes`.
+    """
+
+    def __init__(self, name, method, path, role=None, data=None, setup=None, writes=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.role = role
+        self.data = data
+        self.setup = setup
+        self.writes = writes
+
+    def prepare(self):
+        context = self.setup() if self.setup else {}
+        path = self.path.format(**context)
+        data = self.data(context) if callable(self.data) else self.data
+        return path, data
+
+
+class Command(BaseCommand):
+    help = "Benchmarks every store endpoint and reports latency percentiles, SQL queries and response sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scale', type=float, default=1.0, help='Passed to setup_fake_data')
+        parser.add_argument('--setup', action='store_true',
+                            help='Replace the data in the database with setup_fake_data first (deletes existing store data)')
+        parser.add_argument('--allow-writes', action='store_true',
+                            help='Also run the scenarios that write (carts, cart items and orders, which take real '
+                                 'inventory and queue order_creation events) and create the bench-admin staff user if '
+                                 'there is no staff user')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--endpoint', action='append', default=[], help='Only run scenarios containing this name')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--json', action='store_true', help='Print the JSON report instead of a table')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.allow_writes = options['allow_writes']
+        if options['setup']:
+            call_command('setup_fake_data', scale=options['scale'], seed=options['seed'], stdout=self.stderr)
+
+        if not Product.objects.exists() or not Customer.objects.exists():
+            raise CommandError('The database has no products or customers; run with --setup.')
+
+        self.product_ids = list(Product.objects.values_list('id', flat=True)[:1000])
+        self.category_ids = list(Category.objects.values_list('id', flat=True)[:1000])
+        self.commented_product_ids = list(Comment.objects.values_list('product_id', flat=True).distinct()[:1000])
+        self.cart_ids = [str(cart_id) for cart_id in Cart.objects.filter(items__isnull=False).values_list('id', flat=True)[:1000]]
+        customer = Customer.objects.filter(orders__isnull=False).select_related('user').first() or Customer.objects.select_related('user').first()
+        self.order_ids = list(Order.objects.filter(customer=customer).values_list('id', flat=True)) or [0]
+        self.tokens = {'customer': str(AccessToken.for_user(customer.user))}
+        admin = self.get_admin()
+        if admin is not None:
+            self.tokens['admin'] = str(AccessToken.for_user(admin))
+
+        scenarios = []
+        skipped = []
+        for scenario in self.get_scenarios():
+            if options['endpoint'] and not any(name in scenario.name for name in options['endpoint']):
+                continue
+            if (scenario.writes and not self.allow_writes) or (scenario.role and scenario.role not in self.tokens):
+                skipped.append(scenario.name)
+            else:
+                scenarios.append(scenario)
+        if skipped:
+            self.stderr.write(f'Skipped without --allow-writes: {", ".join(skipped)}')
+        results = []
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            # An address outside INTERNAL_IPS keeps debug_toolbar out of the measurements.
+            client = Client(REMOTE_ADDR='192.0.2.1')
+            for scenario in scenarios:
+                results.append(self.run_scenario(client, scenario, options['iterations'], options['warmup'], options['cold']))
+
+        report = {
+            'meta': {
+                'commit': self.get_commit(),
+                'datetime': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'scale': options['scale'],
+                'cold': options['cold'],
+                'products': Product.objects.count(),
+            },
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_table(results)
+
+        over_budget = [result for result in results if result['over_budget']]
+        if over_budget:
+            raise CommandError('Over the query budget: ' + ', '.join(
+                f'{result["name"]} ({result["queries"]["max"]} > {result["query_budget"]})' for result in over_budget
+            ))
+
+    def get_admin(self):
+        """bench-admin or any other staff user; bench-admin is only created with --allow-writes."""
+        staff = User.objects.filter(is_staff=True, is_active=True)
+        admin = staff.filter(username=BENCHMARK_ADMIN).first() or staff.order_by('pk').first()
+        if admin is None and self.allow_writes:
+            admin = User.objects.create(username=BENCHMARK_ADMIN, email=f'{BENCHMARK_ADMIN}@example.com', is_staff=True)
+        return admin
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def pick(self, values):
+        return self.rng.choice(values)
+
+    def new_cart(self):
+        cart = Cart.objects.create()
+        in_stock = list(Product.objects.filter(inventory__gt=0).values_list('id', flat=True)[:200])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=1) for product_id in self.rng.sample(in_stock, min(3, len(in_stock)))
+        ])
+        return {'cart': cart.id}
+
+    def get_scenarios(self):
+        product = lambda: {'product': self.pick(self.product_ids)}
+        commented_product = lambda: {'product': self.pick(self.commented_product_ids or self.product_ids)}
+        cart = lambda: {'cart': self.pick(self.cart_ids)} if self.cart_ids else self.new_cart()
+        # Without stored carts, every cart scenario creates its own.
+        cart_writes = not self.cart_ids
+        return [
+            Scenario('products-list', 'get', '/store/products/'),
+            Scenario('products-list-deep-page', 'get', '/store/products/?page={page}',
+                     setup=lambda: {'page': max(1, len(self.product_ids) // 10)}),
+            Scenario('products-list-cursor', 'get', '/store/products/?cursor=&ordering=-inventory'),
+            Scenario('products-list-search', 'get', '/store/products/?search={term}',
+                     setup=lambda: {'term': Product.objects.filter(pk=self.pick(self.product_ids)).values_list('name', flat=True)[0].split()[0]}),
+            Scenario('products-detail', 'get', '/store/products/{product}/', setup=product),
+            Scenario('categories-list', 'get', '/store/categories/'),
+            Scenario('categories-detail', 'get', '/store/categories/{category}/',
+                     setup=lambda: {'category': self.pick(self.category_ids)}),
+            Scenario('comments-list', 'get', '/store/products/{product}/comments/', setup=commented_product),
+            Scenario('carts-create', 'post', '/store/carts/', writes=True),
+            Scenario('carts-detail', 'get', '/store/carts/{cart}/', setup=cart, writes=cart_writes),
+            Scenario('carts-summary', 'get', '/store/carts/{cart}/summary/', setup=cart, writes=cart_writes),
+            Scenario('cart-items-list', 'get', '/store/carts/{cart}/items/', setup=cart, writes=cart_writes),
+            Scenario('cart-items-create', 'post', '/store/carts/{cart}/items/', setup=lambda: {**cart(), **product()},
+                     data=lambda context: {'product': context['product'], 'quantity': 1}, writes=True),
+            Scenario('customers-list', 'get', '/store/customers/', role='admin'),
+            Scenario('customers-me', 'get', '/store/customers/me/', role='customer'),
+            Scenario('orders-list', 'get', '/store/orders/', role='customer'),
+            Scenario('orders-list-staff', 'get', '/store/orders/', role='admin'),
+            Scenario('orders-detail', 'get', '/store/orders/{order}/', role='customer',
+                     setup=lambda: {'order': self.pick(self.order_ids)}),
+            Scenario('orders-create', 'post', '/store/orders/', role='customer', setup=self.new_cart,
+                     data=lambda context: {'cart_id': str(context['cart'])}, writes=True),
+        ]
+
+    def run_scenario(self, client, scenario, iterations, warmup, cold):
+        latencies, query_counts, query_times, sizes, statuses = [], [], [], [], set()
+        headers = {'HTTP_AUTHORIZATION': f'JWT {self.tokens[scenario.role]}'} if scenario.role else {}
+        for iteration in range(warmup + iterations):
+            path, data = scenario.prepare()
+            if cold:
+                cache.clear()
+            request = getattr(client, scenario.method)
+            with ExitStack() as stack:
+                # Every alias, so reads routed to replicas count too.
+                captures = [stack.enter_context(CaptureQueriesContext(db)) for db in connections.all()]
+                started = time.perf_counter()
+                response = request(path, data=json.dumps(data) if data else None, content_type='application/json', **headers)
+                elapsed = time.perf_counter() - started
+            queries = [query for capture in captures for query in capture.captured_queries]
+            if iteration < warmup:
+                continue
+            statuses.add(response.status_code)
+            latencies.append(elapsed * 1000)
+            query_counts.append(len(queries))
+            query_times.append(sum(float(query['time']) for query in queries) * 1000)
+            sizes.append(len(response.content))
+        budget = QUERY_BUDGETS.get(scenario.name)
+        return {
+            'name': scenario.name,
+            'method': scenario.method.upper(),
+            'path': scenario.path,
+            'statuses': sorted(statuses),
+            'latency_ms': summarize(latencies),
+            'queries': summarize(query_counts),
+            'query_budget': budget,
+            'over_budget': budget is not None and max(query_counts) > budget,
+            'sql_ms': summarize(query_times),
+            'response_bytes': summarize(sizes),
+        }
+
+    def write_table(self, results):
+        header = f'{"endpoint":<26}{"status":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}{"max":>5}{"budget":>8}{"sql ms":>9}{"bytes":>9}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            self.stdout.write(
+                f'{result["name"]:<26}'
+                f'{",".join(map(str, result["statuses"])):>8}'
+                f'{result["latency_ms"]["p50"]:>9.2f}'
+                f'{result["latency_ms"]["p95"]:>9.2f}'
+                f'{result["latency_ms"]["p99"]:>9.2f}'
+                f'{result["queries"]["mean"]:>9.1f}'
+                f'{result["queries"]["max"]:>5}'
+                f'{"-" if result["query_budget"] is None else result["query_budget"]:>8}'
+                f'{result["sql_ms"]["mean"]:>9.2f}'
+                f'{result["response_bytes"]["mean"]:>9.0f}'
+                + ('  over budget' if result['over_budget'] else '')
+            )
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+
+from store.models import Product
+
+from store.management.commands.benchmark_api import summarize
+
+# Pairs of (name, sync path, async path) returning the same payload.
+ENDPOINTS = [
+    ('products-list', '/store/products/', '/store/async/products/'),
+    ('products-list-page-2', '/store/products/?page=2', '/store/async/products/?page=2'),
+    ('products-detail', '/store/products/{product}/', '/store/async/products/{product}/'),
+    ('categories-list', '/store/categories/', '/store/async/categories/'),
+]
+
+
+def comparable(content):
+    # Pagination links point at each view's own path.
+    data = json.loads(content)
+    if isinstance(data, dict):
+        data.pop('next', None)
+        data.pop('previous', None)
+    return data
+
+
+class Command(BaseCommand):
+    help = "Compares the concurrent-request throughput of the sync and async catalog endpoints under ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scale', type=float, default=1.0, help='Passed to setup_fake_data')
+        parser.add_argument('--setup', action='store_true',
+                            help='Replace the data in the database with setup_fake_data first (deletes existing store data)')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--endpoint', action='append', default=[], help='Only run endpoints containing this name')
+        parser.add_argument('--json', action='store_true', help='Print the JSON report instead of a table')
+
+    def handle(self, *args, **options):
+        if options['setup']:
+            call_command('setup_fake_data', scale=options['scale'], seed=options['seed'], stdout=self.stderr)
+        product = Product.objects.order_by('id').values_list('id', flat=True).first()
+        if product is None:
+            raise CommandError('The database has no products; run with --setup.')
+
+        endpoints = [
+            (name, sync_path.format(product=product), async_path.format(product=product))
+            for name, sync_path, async_path in ENDPOINTS
+            if not options['endpoint'] or any(endpoint in name for endpoint in options['endpoint'])
+        ]
+        # debug_toolbar's middleware is sync only and would run every async request through a thread.
+        middleware = [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar.')]
+        with override_settings(ALLOWED_HOSTS=['testserver'], MIDDLEWARE=middleware):
+            results = asyncio.run(self.run_all(endpoints, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.write_table(results)
+
+    async def run_all(self, endpoints, options):
+        results = []
+        for name, sync_path, async_path in endpoints:
+            result = {'name': name, 'same_payload': None}
+            contents = {}
+            for mode, path in [('sync', sync_path), ('async', async_path)]:
+                result[mode], contents[mode] = await self.run_endpoint(path, options)
+            result['same_payload'] = comparable(contents['sync']) == comparable(contents['async'])
+            results.append(result)
+        return results
+
+    async def run_endpoint(self, path, options):
+        client = AsyncClient(REMOTE_ADDR='192.0.2.1')
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies, statuses = [], set()
+        content = (await client.get(path)).content
+
+        async def request():
+            async with semaphore:
+                if options['cold']:
+                    cache.clear()
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses.add(response.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        return {
+            'statuses': sorted(statuses),
+            'requests_per_second': options['requests'] / elapsed,
+            'latency_ms': summarize(latencies),
+        }, content
+
+    def write_table(self, results):
+        header = f'{"endpoint":<24}{"mode":>7}{"status":>8}{"req/s":>10}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            for mode in ['sync', 'async']:
+                stats = result[mode]
+                self.stdout.write(
+                    f'{result["name"] if mode == "sync" else "":<24}'
+                    f'{mode:>7}'
+                    f'{",".join(map(str, stats["statuses"])):>8}'
+                    f'{stats["requests_per_second"]:>10.1f}'
+                    f'{stats["latency_ms"]["p50"]:>9.2f}'
+                    f'{stats["latency_ms"]["p95"]:>9.2f}'
+                    f'{stats["latency_ms"]["p99"]:>9.2f}'
+                )
+            self.stdout.write(f'{"":<24}{"same payload" if result["same_payload"] else "PAYLOADS DIFFER":>31}')
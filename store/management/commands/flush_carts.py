@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.carts import get_cart_store
+
+
+class Command(BaseCommand):
+    help = "Writes pending cart changes of the configured cart store back to the database"
+
+    def handle(self, *args, **kwargs):
+        flushed = get_cart_store().flush_all()
+        self.stdout.write(f'Flushed {flushed} carts.')
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+PRUNE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = "Dispatches pending outbox events (e.g. order_creation) to their signal receivers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when there is nothing to do')
+        parser.add_argument('--once', action='store_true', help='Drain the due events and exit')
+        parser.add_argument(
+            '--prune-days', type=float, default=None,
+            help='Delete done events processed more than this many days ago (checked hourly while idle)',
+        )
+
+    def handle(self, *args, **options):
+        pruned_at = None
+        while True:
+            done, retried, dead = outbox.process_batch(
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                max_attempts=options['max_attempts'],
+            )
+            if done or retried or dead:
+                self.stdout.write(f'{done} done, {retried} to retry, {dead} dead-lettered')
+                continue
+            if options['prune_days'] is not None and (pruned_at is None or time.monotonic() - pruned_at >= PRUNE_INTERVAL):
+                pruned = outbox.prune(timedelta(days=options['prune_days']))
+                pruned_at = time.monotonic()
+                if pruned:
+                    self.stdout.write(f'{pruned} done events pruned')
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.carts import delete_carts_chunk, get_cart_store, get_expired_carts
+
+
+class Command(BaseCommand):
+    help = "Deletes carts past their TTL (STORE_CART_TTL / STORE_EMPTY_CART_TTL) in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between chunks')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting when done')
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between sweeps with --loop')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the expired carts')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def sweep(self, options):
+        # Pending write-behind changes count as activity, so land them before judging what expired.
+        get_cart_store().flush_all()
+        expired = get_expired_carts()
+        if options['dry_run']:
+            self.stdout.write(f'{sum(carts.count() for carts in expired)} carts expired.')
+            return
+
+        started = time.monotonic()
+        carts = items = 0
+        for queryset in expired:
+            while True:
+                deleted_carts, deleted_items = delete_carts_chunk(queryset, options['chunk_size'])
+                carts += deleted_carts
+                items += deleted_items
+                if deleted_carts < options['chunk_size']:
+                    break
+                time.sleep(options['sleep'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Deleted {carts} carts and {items} items in {elapsed:.1f}s ({carts / max(elapsed, 1e-6):,.0f} carts/s).'
+        )
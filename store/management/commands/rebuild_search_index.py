@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product search index (no-op on databases with a FULLTEXT index)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=search.INDEX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(f'Indexed {indexed} products.')
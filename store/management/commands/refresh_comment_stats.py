@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from store.models import ProductCommentStats, Product
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-product approved/pending comment counts from the comments table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Product.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        for start in range(1, last_id + 1, batch_size):
+            ProductCommentStats.objects.refresh(range(start, start + batch_size))
+        self.stdout.write(f'Refreshed comment stats of {ProductCommentStats.objects.count()} products.')
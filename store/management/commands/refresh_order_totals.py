@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Sum, Value
+from django.db.models.functions import Coalesce
+
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = "Backfills or repairs the stored items_count and total_amount of orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--check', action='store_true', help='Only report orders whose stored totals are wrong')
+
+    def get_stale_ids(self, start, end):
+        orders = Order.objects.filter(id__gte=start, id__lt=end).annotate(
+            actual_count=Count('items'),
+            actual_amount=Coalesce(
+                Sum(F('items__quantity') * F('items__unit_price')),
+                Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        ).values_list('id', 'items_count', 'total_amount', 'actual_count', 'actual_amount')
+        return [
+            order_id for order_id, items_count, total_amount, actual_count, actual_amount in orders
+            if items_count != actual_count or total_amount != actual_amount
+        ]
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        stale = 0
+        for start in range(1, last_id + 1, batch_size):
+            with transaction.atomic():
+                stale_ids = self.get_stale_ids(start, start + batch_size)
+                if stale_ids and not options['check']:
+                    Order.objects.refresh_totals(stale_ids)
+            stale += len(stale_ids)
+        if options['check']:
+            self.stdout.write(f'{stale} orders have stale totals.')
+        else:
+            self.stdout.write(f'Repaired {stale} orders.')
@@ -1,35 +1,36 @@
 # setup_test_data.py
+import multiprocessing
 import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 from faker import Faker
-from datetime import datetime, timedelta
-import factory
-from factory.fuzzy import FuzzyDateTime
 
-from django.db import transaction
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max
 from django.utils import timezone
-from django.core.management.base import BaseCommand
-from django.utils.timezone import make_aware
-from django.utils.timezone import get_current_timezone
-from config import settings
-
-from store.models import Address, Cart, CartItem, Category, Comment, Order, OrderItem, Product, Discount, Customer
-from store.factories import (
-    CartFactory,
-    CategoryFactory,
-    CommentFactory,
-    OrderItemFactory,
-    ProductFactory,
-    DiscountFactory,
-    CustomerFactory,
-    AddressFactory,
-    OrderFactory,
-    CartItemFactory,
-)
-
-faker = Faker()
-
-list_of_models = [CartItem, Cart, OrderItem, Order, Product, Category, Comment, Discount, Address, Customer]
+from django.utils.text import slugify
 
+from store import search
+from store.cache import invalidate_product_caches
+from store.models import (Address, Cart, CartItem, Category, Comment, Order, OrderItem, Product, ProductSearchTerm,
+                          Discount, Customer, OutboxEvent, ProductCommentStats)
+
+User = get_user_model()
+
+FAKE_USERNAME_PREFIX = 'fake-'
+
+# Children before parents, so raw deletes never trip a foreign key.
+list_of_models = [CartItem, Cart, OrderItem, OutboxEvent, Order, Comment, ProductCommentStats, ProductSearchTerm,
+                  Product.discounts.through, Product, Category, Discount, Address]
+
+# Row counts at --scale 1.
 NUM_CATEGORIES = 100
 NUM_DISCOUNTS = 10
 NUM_PRODUCTS = 1000
@@ -37,100 +38,321 @@ NUM_CUSTOMERS = 100
 NUM_ORDERS = 30
 NUM_CARTS = 100
 
+ITEMS_PER_ORDER = (1, 10)
+COMMENTS_PER_PRODUCT = (1, 5)
+ITEMS_PER_CART = (1, 10)
+
+TABLE_COUNTS = {
+    'categories': NUM_CATEGORIES,
+    'discounts': NUM_DISCOUNTS,
+    'products': NUM_PRODUCTS,
+    'customers': NUM_CUSTOMERS,
+    'orders': NUM_ORDERS,
+    'carts': NUM_CARTS,
+}
+
+BATCH_SIZE = 1000
+# Rows of the driving table per task; fixed so the output only depends on --seed.
+CHUNK_SIZE = 10000
+
+
+def product_price(seed, product_id):
+    # Derived from the id so order items can copy a price without reading products back.
+    return Decimal((product_id * 2654435761 + seed * 97) % 99901 + 100) / 100
+
+
+def random_datetime(rng):
+    return datetime(rng.randrange(2019, 2023), rng.randint(1, 12), rng.randint(1, 28),
+                    rng.randint(0, 23), rng.randint(0, 59), tzinfo=dt_timezone.utc)
+
+
+def sentence(rng, words, nb_words):
+    return ' '.join(rng.choices(words, k=nb_words)).capitalize() + '.'
+
+
+def paragraph(rng, words, nb_sentences):
+    return ' '.join(sentence(rng, words, rng.randint(5, 12)) for _ in range(nb_sentences))
+
+
+def generate_categories(rng, start, count, ctx):
+    for category_id in range(start, start + count):
+        yield Category(
+            id=category_id,
+            title=sentence(rng, ctx['words'], rng.randint(2, 5))[:-1],
+            description=sentence(rng, ctx['words'], 10),
+        )
+
+
+def generate_discounts(rng, start, count, ctx):
+    for discount_id in range(start, start + count):
+        yield Discount(id=discount_id, discount=rng.randint(1, 80) / 100, description=sentence(rng, ctx['words'], 8))
+
+
+def generate_products(rng, start, count, ctx):
+    words = ctx['words']
+    for product_id in range(start, start + count):
+        name = ' '.join(word.capitalize() for word in rng.sample(words, 3))
+        datetime_created = random_datetime(rng)
+        yield Product(
+            id=product_id,
+            name=name,
+            slug=slugify(name),
+            description=paragraph(rng, words, rng.randint(1, 5)),
+            unit_price=product_price(ctx['seed'], product_id),
+            inventory=rng.randint(1, 100),
+            category_id=rng.randrange(*ctx['categories']),
+            datetime_created=datetime_created,
+            datetime_modified=datetime_created + timedelta(hours=rng.randint(1, 500)),
+        )
+
+
+def generate_customers(rng, start, count, ctx):
+    # One user, customer and address per id; users and customers share the offset.
+    user_offset = ctx['users'][0] - ctx['customers'][0]
+    users, customers, addresses = [], [], []
+    for customer_id in range(start, start + count):
+        user_id = customer_id + user_offset
+        users.append(User(
+            id=user_id,
+            username=f'{FAKE_USERNAME_PREFIX}{user_id}',
+            email=f'{FAKE_USERNAME_PREFIX}{user_id}@example.com',
+            password=ctx['password'],
+            first_name=rng.choice(ctx['first_names']),
+            last_name=rng.choice(ctx['last_names']),
+            date_joined=random_datetime(rng),
+        ))
+        customers.append(Customer(
+            id=customer_id,
+            user_id=user_id,
+            phone_number=f'+1-{rng.randint(200, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}',
+            birth_date=(datetime(1990, 1, 1) + timedelta(days=rng.randint(0, 9131))).date() if rng.random() > 0.3 else None,
+        ))
+        addresses.append(Address(
+            customer_id=customer_id,
+            province=rng.choice(ctx['words']),
+            city=rng.choice(ctx['words']),
+            street=f'street {rng.randint(1, 50)}',
+        ))
+    yield from users
+    yield from customers
+    yield from addresses
+
+
+def generate_orders(rng, start, count, ctx):
+    products = range(*ctx['products'])
+    orders, items = [], []
+    for order_id in range(start, start + count):
+        order_items = [
+            OrderItem(
+                order_id=order_id,
+                product_id=product_id,
+                quantity=rng.randint(1, 20),
+                unit_price=product_price(ctx['seed'], product_id),
+            )
+            for product_id in rng.sample(products, min(rng.randint(*ITEMS_PER_ORDER), len(products)))
+        ]
+        orders.append(Order(
+            id=order_id,
+            customer_id=rng.randrange(*ctx['customers']),
+            datetime_created=random_datetime(rng),
+            status=rng.choice([Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED]),
+            items_count=len(order_items),
+            total_amount=sum(item.quantity * item.unit_price for item in order_items),
+        ))
+        items.extend(order_items)
+    yield from orders
+    yield from items
+
+
+def generate_comments(rng, start, count, ctx):
+    statuses = [Comment.COMMENT_STATUS_WAITING, Comment.COMMENT_STATUS_APPROVED, Comment.COMMENT_STATUS_NOT_APPROVED]
+    for product_id in range(start, start + count):
+        for _ in range(rng.randint(*COMMENTS_PER_PRODUCT)):
+            yield Comment(
+                product_id=product_id,
+                name=rng.choice(ctx['first_names']),
+                body=paragraph(rng, ctx['words'], 3),
+                datetime_created=random_datetime(rng),
+                status=rng.choice(statuses),
+            )
+
+
+def generate_carts(rng, start, count, ctx):
+    products = range(*ctx['products'])
+    now = timezone.now()
+    carts, items = [], []
+    for _ in range(count):
+        cart_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 60))
+        carts.append(Cart(id=cart_id, created_at=created_at, updated_at=created_at))
+        for product_id in rng.sample(products, min(rng.randint(*ITEMS_PER_CART), len(products))):
+            items.append(CartItem(cart_id=cart_id, product_id=product_id, quantity=rng.randint(1, 20)))
+    yield from carts
+    yield from items
+
+
+GENERATORS = {
+    'categories': generate_categories,
+    'discounts': generate_discounts,
+    'products': generate_products,
+    'customers': generate_customers,
+    'orders': generate_orders,
+    'comments': generate_comments,
+    'carts': generate_carts,
+}
+
+# Tables within a stage only reference tables of earlier stages.
+STAGES = [
+    ['categories', 'discounts'],
+    ['products', 'customers'],
+    ['orders', 'comments', 'carts'],
+]
+
+
+@contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the generated values of auto_now / auto_now_add fields."""
+    fields = [
+        field for model in apps.get_models() for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def write_rows(rows, batch_size):
+    written = 0
+    batch = []
+    for row in rows:
+        if batch and (type(row) is not type(batch[0]) or len(batch) >= batch_size):
+            type(batch[0]).objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+        batch.append(row)
+    if batch:
+        type(batch[0]).objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def run_task(task):
+    table, chunk, start, count, ctx = task
+    # String seeds are hashed deterministically, so output does not depend on --workers.
+    rng = random.Random(f'{ctx["seed"]}:{table}:{chunk}')
+    with explicit_timestamps(), transaction.atomic():
+        written = write_rows(GENERATORS[table](rng, start, count, ctx), ctx['batch_size'])
+    return table, written
+
+
 class Command(BaseCommand):
     help = "Generates fake data"
 
-    @transaction.atomic
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplies the row counts of every table')
+        parser.add_argument('--count', action='append', default=[], metavar='TABLE=N',
+                            help=f'Overrides the count of one of: {", ".join(TABLE_COUNTS)}')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to generate each stage')
+
+    def get_counts(self, scale, overrides):
+        counts = {table: max(1, int(count * scale)) for table, count in TABLE_COUNTS.items()}
+        for override in overrides:
+            table, _, count = override.partition('=')
+            if table not in counts or not count.isdigit():
+                raise CommandError(f'Invalid --count {override!r}')
+            counts[table] = int(count)
+        counts['comments'] = counts['products']
+        return counts
+
+    def delete_old_data(self):
+        Category.objects.update(top_product=None)
+        for model in list_of_models:
+            model.objects.all()._raw_delete(model.objects.db)
+        Customer.objects.filter(user__username__startswith=FAKE_USERNAME_PREFIX)._raw_delete(Customer.objects.db)
+        User.objects.filter(username__startswith=FAKE_USERNAME_PREFIX)._raw_delete(User.objects.db)
+
+    @staticmethod
+    def next_id(model):
+        return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    def handle(self, *args, **options):
+        seed = options['seed']
+        batch_size = options['batch_size']
+        workers = options['workers']
+        counts = self.get_counts(options['scale'], options['count'])
+
         self.stdout.write("Deleting old data...")
-        models = list_of_models
-        for m in models:
-            m.objects.all().delete()
+        self.delete_old_data()
 
         self.stdout.write("Creating new data...\n")
+        Faker.seed(seed)
+        faker = Faker()
+        ranges = {}
+        for table, model in [('categories', Category), ('discounts', Discount), ('products', Product),
+                             ('customers', Customer), ('orders', Order), ('users', User)]:
+            start = self.next_id(model)
+            ranges[table] = (start, start + counts.get(table, counts['customers']))
+        ranges['comments'] = ranges['products']
+        ranges['carts'] = (0, counts['carts'])
+        ctx = {
+            'seed': seed,
+            'batch_size': batch_size,
+            'words': faker.words(nb=500, unique=True),
+            'first_names': [faker.first_name() for _ in range(500)],
+            'last_names': [faker.last_name() for _ in range(500)],
+            'password': make_password('password'),
+            **ranges,
+        }
 
-        tz = timezone.get_current_timezone()
-
-        # Categories data
-        print(f"Adding {NUM_CATEGORIES} categories...", end='')
-        all_categories = [CategoryFactory(top_product=None) for _ in range(NUM_CATEGORIES)]
-        print('DONE')
-        
-        # Discounts data
-        print(f"Adding {NUM_DISCOUNTS} discounts...", end='')
-        all_discounts = [DiscountFactory() for _ in range(NUM_DISCOUNTS)]
-        print('DONE')
-
-        # Products data
-        print(f"Adding {NUM_PRODUCTS} product...", end='')
-        all_products = list()
-        for _ in range(NUM_PRODUCTS):
-            new_product = ProductFactory(category_id=random.choice(all_categories).id)
-            new_product.datetime_created = datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12), tzinfo=timezone.utc)
-            new_product.datetime_modified = new_product.datetime_created + timedelta(hours=random.randint(1, 500))
-            new_product.save()
-            all_products.append(new_product)
-        print('DONE')
-
-        # Customers data
-        print(f"Adding {NUM_CUSTOMERS} customers...", end='')
-        all_customers = [(CustomerFactory() if (random.random() > 0.3) else CustomerFactory(birth_date=None)) for _ in range(NUM_CUSTOMERS) ]
-        print('DONE')
-
-        # Addresses data
-        print(f"Adding customers addresses...", end='')
-        all_addresses = [
-            AddressFactory(customer_id=customer.id) for customer in all_customers
-        ]
-        print('DONE')
-
-        # Orders data
-        print(f"Adding {NUM_ORDERS} orders...", end='')
-        all_orders = [OrderFactory(
-            customer_id=random.choice(all_customers).id
-        ) for _ in range(NUM_ORDERS)]
-        for order in all_orders:
-            order.datetime_created =  datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12), tzinfo=timezone.utc)
-            order.save()
-        print('DONE')
-
-        # OrderItems data
-        print(f"Adding order items...", end='')
-        all_order_items = list()
-        for order in all_orders:
-            products = random.sample(all_products, random.randint(1, 10))
-            for product in products:
-                order_item = OrderItemFactory(
-                    order_id=order.id,
-                    product_id=product.id,
-                    unit_price=product.unit_price,
-                )
-                all_order_items.append(order_item)
-        print('DONE')
-
-        # Comments data
-        print(f"Adding product comments...", end='')
-        for product in all_products:
-            for _ in range(random.randint(1, 5)):
-                comment = CommentFactory(product_id=product.id)
-                comment.datetime_created = datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12), tzinfo=timezone.utc)
-                comment.save()
-        print('DONE')
-
-        # Carts data
-        print(f"Adding {NUM_CARTS} carts...", end='')
-        all_carts = [CartFactory() for _ in range(NUM_CARTS)]
-        print('DONE')
-
-        # CartItems data
-        print(f"Adding cart items...", end='')
-        all_cart_items = list()
-        for cart in all_carts:
-            products = random.sample(all_products, random.randint(1, 10))
-            for product in products:
-                cart_item = CartItemFactory(
-                    cart_id=cart.id,
-                    product_id=product.id,
-                )
-                all_cart_items.append(cart_item)
-        print('DONE')
+        chunk_size = CHUNK_SIZE
+        started = time.monotonic()
+        total_rows = 0
+        for stage in STAGES:
+            tasks = []
+            for table in stage:
+                start, end = ranges[table]
+                for chunk, chunk_start in enumerate(range(start, end, chunk_size)):
+                    tasks.append((table, chunk, chunk_start, min(chunk_size, end - chunk_start), ctx))
+            total_rows += self.run_stage(stage, tasks, workers)
+
+        self.stdout.write("Rebuilding search index...", ending='')
+        search.rebuild_index(batch_size=batch_size)
+        self.stdout.write('DONE')
+        # Comments are bulk created, so their signals never kept the stats up to date.
+        ProductCommentStats.objects.refresh()
+        invalidate_product_caches()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'DONE: {total_rows:,} rows in {elapsed:.1f}s ({total_rows / elapsed:,.0f} rows/s)')
+
+    def run_stage(self, stage, tasks, workers):
+        started = time.monotonic()
+        written = dict.fromkeys(stage, 0)
+        if workers > 1:
+            # Forked children must not share the parent's database connections.
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                results = pool.imap_unordered(run_task, tasks)
+                for table, rows in results:
+                    written[table] += rows
+                    self.report_progress(written, started)
+        else:
+            for table, rows in map(run_task, tasks):
+                written[table] += rows
+                self.report_progress(written, started)
+        self.stdout.write('')
+        return sum(written.values())
+
+    def report_progress(self, written, started):
+        rows = sum(written.values())
+        rate = rows / max(time.monotonic() - started, 1e-6)
+        tables = ', '.join(f'{table} {count:,}' for table, count in written.items())
+        self.stdout.write(f'\r  {tables} rows ({rate:,.0f} rows/s)', ending='')
+        self.stdout.flush()
@@ -0,0 +1,189 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """A labelled histogram kept in process memory and exposed in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self.series.items())
+        for labels, (counts, total, count) in series:
+            label_text = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{format_bound(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+REQUEST_DURATION = Histogram(
+    'store_http_request_duration_seconds', 'Time spent handling a request.',
+    ('view', 'action', 'method', 'status'), LATENCY_BUCKETS,
+)
+VIEW_DURATION = Histogram(
+    'store_view_duration_seconds', 'Time spent in the view, before rendering.',
+    ('view', 'action'), LATENCY_BUCKETS,
+)
+RENDER_DURATION = Histogram(
+    'store_render_duration_seconds', 'Time spent rendering (serialising) the response.',
+    ('view', 'action'), LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'store_db_queries_per_request', 'SQL queries executed per request.',
+    ('view', 'action'), QUERY_COUNT_BUCKETS,
+)
+DB_DURATION = Histogram(
+    'store_db_query_duration_seconds', 'Time spent in SQL queries per request.',
+    ('view', 'action'), LATENCY_BUCKETS,
+)
+
+REGISTRY = [REQUEST_DURATION, VIEW_DURATION, RENDER_DURATION, DB_QUERIES, DB_DURATION]
+
+
+class QueryTracker:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def get_view_labels(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved', request.method.lower()
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match.func.__name__, request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return view_class.__name__, actions.get(request.method.lower(), request.method.lower())
+
+
+class MetricsMiddleware:
+    """
+    Records per request latency, view and render time, and SQL query count and time,
+    labelled by view (the DRF viewset) and action. Read them from `metrics_view`.
+    Works in both modes, so it does not push async views onto a thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Sync hooks would be run in a thread for every async request.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        tracker = QueryTracker()
+        request._metrics = {}
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.track_queries(stack, tracker)
+            response = self.get_response(request)
+        self.record(request, response, tracker, started)
+        return response
+
+    async def __acall__(self, request):
+        tracker = QueryTracker()
+        request._metrics = {}
+        started = time.perf_counter()
+        # The async ORM and sync views run queries in the request's thread-sensitive
+        # worker thread, on that thread's connections, so the wrappers go there.
+        stack = ExitStack()
+        await sync_to_async(self.track_queries)(stack, tracker)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, tracker, started)
+        return response
+
+    @staticmethod
+    def track_queries(stack, tracker):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(tracker))
+
+    @staticmethod
+    def record(request, response, tracker, started):
+        finished = time.perf_counter()
+        view, action = get_view_labels(request)
+        REQUEST_DURATION.observe((view, action, request.method, str(response.status_code)), finished - started)
+        DB_QUERIES.observe((view, action), tracker.count)
+        DB_DURATION.observe((view, action), tracker.duration)
+        timings = request._metrics
+        if 'view_started' in timings and 'view_finished' in timings:
+            VIEW_DURATION.observe((view, action), timings['view_finished'] - timings['view_started'])
+        if 'view_finished' in timings and 'rendered' in timings:
+            RENDER_DURATION.observe((view, action), timings['rendered'] - timings['view_finished'])
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timings = request._metrics
+        timings['view_finished'] = time.perf_counter()
+        response.add_post_render_callback(lambda _: timings.__setitem__('rendered', time.perf_counter()))
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return self.__class__.process_view(self, request, view_func, view_args, view_kwargs)
+
+    async def aprocess_template_response(self, request, response):
+        return self.__class__.process_template_response(self, request, response)
+
+
+def metrics_view(request):
+    body = '\n'.join(histogram.expose() for histogram in REGISTRY) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
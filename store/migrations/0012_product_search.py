@@ -0,0 +1,72 @@
+# Generated by Django 5.0.3 on 2026-10-17 17:51
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of store.search as of this migration.
+FULLTEXT_VENDORS = ('mysql',)
+FULLTEXT_INDEX_NAME = 'store_product_fulltext'
+TOKEN_RE = re.compile(r'\w+')
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())
+        if len(token) >= MIN_TERM_LENGTH
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor in FULLTEXT_VENDORS:
+        schema_editor.execute(
+            f'ALTER TABLE store_product ADD FULLTEXT INDEX {FULLTEXT_INDEX_NAME} (name, description)'
+        )
+        return
+
+    Product = apps.get_model('store', 'Product')
+    ProductSearchTerm = apps.get_model('store', 'ProductSearchTerm')
+    terms = []
+    for product in Product.objects.using(connection.alias).only('id', 'name', 'description').iterator():
+        weights = Counter()
+        for term in tokenize(product.name):
+            weights[term] += NAME_WEIGHT
+        for term in tokenize(product.description):
+            weights[term] += DESCRIPTION_WEIGHT
+        terms.extend(ProductSearchTerm(product_id=product.id, term=term, weight=weight) for term, weight in weights.items())
+    ProductSearchTerm.objects.using(connection.alias).bulk_create(terms, batch_size=500)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in FULLTEXT_VENDORS:
+        schema_editor.execute(f'ALTER TABLE store_product DROP INDEX {FULLTEXT_INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='store.product')),
+            ],
+            options={
+                'unique_together': {('term', 'product')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
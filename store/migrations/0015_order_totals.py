@@ -0,0 +1,40 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:04
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    alias = schema_editor.connection.alias
+    items = OrderItem.objects.using(alias).filter(order_id=models.OuterRef('pk')).order_by().values('order_id')
+    Order.objects.using(alias).update(
+        items_count=Coalesce(models.Subquery(items.annotate(count=models.Count('id')).values('count')), 0),
+        total_amount=Coalesce(
+            models.Subquery(items.annotate(amount=models.Sum(models.F('quantity') * models.F('unit_price'))).values('amount')),
+            models.Value(0),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
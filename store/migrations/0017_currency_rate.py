@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:11
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def add_rial_rate(apps, schema_editor):
+    # The rate that used to be hard-coded as DOLLAR_TO_RIAL.
+    CurrencyRate = apps.get_model('store', 'CurrencyRate')
+    CurrencyRate.objects.using(schema_editor.connection.alias).create(code='IRR', rate=600000, decimal_places=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=3, unique=True)),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=18, validators=[django.core.validators.MinValueValidator(0)])),
+                ('decimal_places', models.PositiveSmallIntegerField(default=2)),
+                ('datetime_modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(add_rial_rate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_currency_rate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['datetime_created'], name='store_order_datetim_0a5b0f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['datetime_created'], name='store_produ_datetim_7c5d3d_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_comment_stats(apps, schema_editor):
+    Comment = apps.get_model('store', 'Comment')
+    ProductCommentStats = apps.get_model('store', 'ProductCommentStats')
+    alias = schema_editor.connection.alias
+    counts = Comment.objects.using(alias).order_by().values('product_id').annotate(
+        approved_count=models.Count('id', filter=models.Q(status='a')),
+        pending_count=models.Count('id', filter=models.Q(status='w')),
+    )
+    ProductCommentStats.objects.using(alias).bulk_create([ProductCommentStats(**row) for row in counts], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCommentStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='comment_stats', serialize=False, to='store.product')),
+                ('approved_count', models.PositiveIntegerField(default=0)),
+                ('pending_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'product comment stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product', 'status', 'datetime_created'], name='store_comme_product_fd5c95_idx'),
+        ),
+        migrations.RunPython(backfill_comment_stats, migrations.RunPython.noop),
+    ]
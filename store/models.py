@@ -1,12 +1,17 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.utils import timezone
 from uuid import uuid4
 
 class Category(models.Model):
     title = models.CharField(max_length=255)
     description = models.CharField(max_length=500, blank=True)
     top_product = models.ForeignKey('Product', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     def __str__(self):
         return self.title
@@ -31,10 +36,26 @@ class Product(models.Model):
     datetime_modified = models.DateTimeField(auto_now=True)
     discounts = models.ManyToManyField(Discount, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id']),
+            models.Index(fields=['inventory', 'id']),
+            models.Index(fields=['datetime_created']),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class ProductSearchTerm(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['term', 'product']]
+
+
 class Customer(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, )
     phone_number = models.CharField(max_length=255)
@@ -61,6 +82,24 @@ class UnpaidOrderManger(models.Manager):
         return super().get_queryset().filter(status=Order.ORDER_STATUS_UNPAID)
 
 
+class OrderManager(models.Manager):
+    def refresh_totals(self, order_ids=None):
+        """Recompute items_count and total_amount from the order items (and bump the version), in one UPDATE."""
+        items = OrderItem.objects.filter(order_id=models.OuterRef('pk')).order_by().values('order_id')
+        orders = self.get_queryset()
+        if order_ids is not None:
+            orders = orders.filter(pk__in=order_ids)
+        return orders.update(
+            version=models.F('version') + 1,
+            items_count=Coalesce(models.Subquery(items.annotate(count=models.Count('id')).values('count')), 0),
+            total_amount=Coalesce(
+                models.Subquery(items.annotate(amount=models.Sum(models.F('quantity') * models.F('unit_price'))).values('amount')),
+                models.Value(0),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
 class Order(models.Model):
     ORDER_STATUS_PAID = 'p'
     ORDER_STATUS_UNPAID = 'u'
@@ -74,10 +113,20 @@ class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='orders')
     datetime_created = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=1, choices=ORDER_STATUS, default=ORDER_STATUS_UNPAID)
+    items_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    version = models.PositiveIntegerField(default=1, editable=False)
 
-    objects = models.Manager()
+    objects = OrderManager()
     unpaid_orders = UnpaidOrderManger()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'datetime_created']),
+            models.Index(fields=['status', 'datetime_created']),
+            models.Index(fields=['datetime_created']),
+        ]
+
     def __str__(self):
         return f'Order id={self.id}'
 
@@ -121,10 +170,96 @@ class Comment(models.Model):
     objects = CommentManger()
     approved = ApprovedCommentManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'status', 'datetime_created']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row held when loaded, so a save can move the comment between ProductCommentStats counters.
+        if 'product_id' in field_names and 'status' in field_names:
+            instance._loaded_values = (instance.product_id, instance.status)
+        return instance
+
+
+class ProductCommentStatsManager(models.Manager):
+    def record_change(self, old=None, new=None):
+        """Move one comment between counters; `old` and `new` are (product_id, status) or None."""
+        if old == new:
+            return
+        for values, step in [(old, -1), (new, 1)]:
+            field = ProductCommentStats.STATUS_FIELDS.get(values[1]) if values else None
+            if field is None:
+                continue
+            updated = self.filter(product_id=values[0]).update(**{field: models.F(field) + step})
+            # A missing row is rebuilt from the comments, which already include this one.
+            if not updated and step > 0:
+                self.refresh([values[0]])
+
+    def refresh(self, product_ids=None):
+        """Recount the stats of `product_ids` (or every product) from the comments table."""
+        comments = Comment.objects.order_by()
+        stats = self.get_queryset()
+        if product_ids is not None:
+            comments = comments.filter(product_id__in=product_ids)
+            stats = stats.filter(product_id__in=product_ids)
+        counts = comments.values('product_id').annotate(**{
+            field: models.Count('id', filter=models.Q(status=status))
+            for status, field in ProductCommentStats.STATUS_FIELDS.items()
+        })
+        with transaction.atomic():
+            stats.delete()
+            self.bulk_create([self.model(**row) for row in counts], batch_size=1000)
+
+
+class ProductCommentStats(models.Model):
+    STATUS_FIELDS = {
+        Comment.COMMENT_STATUS_APPROVED: 'approved_count',
+        Comment.COMMENT_STATUS_WAITING: 'pending_count',
+    }
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='comment_stats')
+    approved_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+
+    objects = ProductCommentStatsManager()
+
+    class Meta:
+        verbose_name_plural = 'product comment stats'
+
+
+class CartManager(models.Manager):
+    def with_totals(self):
+        return self.get_queryset().annotate(
+            items_count=models.Count('items'),
+            # An empty cart sums to NULL.
+            total_price=Coalesce(
+                models.Sum(models.F('items__quantity') * models.F('items__product__unit_price')),
+                models.Value(Decimal(0)),
+                output_field=models.DecimalField(max_digits=14, decimal_places=2),
+            ),
+        )
+
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = CartManager()
+
+
+class CartItemManager(models.Manager):
+    def with_total_price(self):
+        return self.get_queryset().annotate(
+            total_price=models.ExpressionWrapper(
+                models.F('quantity') * models.F('product__unit_price'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
 
 
 class CartItem(models.Model):
@@ -132,5 +267,46 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cart_items')
     quantity = models.PositiveSmallIntegerField()
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = [['cart', 'product']]
+
+
+class OutboxEvent(models.Model):
+    EVENT_STATUS_PENDING = 'p'
+    EVENT_STATUS_DONE = 'd'
+    EVENT_STATUS_DEAD = 'x'
+    EVENT_STATUS = [
+        (EVENT_STATUS_PENDING, 'Pending'),
+        (EVENT_STATUS_DONE, 'Done'),
+        (EVENT_STATUS_DEAD, 'Dead'),
+    ]
+
+    event = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=EVENT_STATUS, default=EVENT_STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    datetime_processed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.event} id={self.id}'
+
+
+class CurrencyRate(models.Model):
+    # Product prices are stored in dollars; `rate` is the amount of this currency per dollar.
+    code = models.CharField(max_length=3, unique=True)
+    rate = models.DecimalField(max_digits=18, decimal_places=6, validators=[MinValueValidator(0)])
+    decimal_places = models.PositiveSmallIntegerField(default=2)
+    datetime_modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.code} = {self.rate}'
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, OutboxEvent
+from .signals import order_creation
+
+ORDER_CREATION = 'order_creation'
+
+LEASE = timedelta(minutes=5)
+BACKOFF_BASE = timedelta(seconds=10)
+BACKOFF_MAX = timedelta(hours=1)
+PRUNE_CHUNK_SIZE = 1000
+
+
+class OutboxDispatchError(Exception):
+    pass
+
+
+def publish(event, **payload):
+    """Record an event; call inside the transaction that makes the change it describes."""
+    return OutboxEvent.objects.create(event=event, payload=payload)
+
+
+def dispatch_order_creation(payload):
+    order = Order.objects.get(pk=payload['order_id'])
+    return order_creation.send_robust(sender=Order, order=order)
+
+
+HANDLERS = {
+    ORDER_CREATION: dispatch_order_creation,
+}
+
+
+def dispatch(event):
+    # Receivers run again on retry, so they have to be idempotent.
+    try:
+        responses = HANDLERS[event.event](event.payload)
+        errors = [
+            f'{getattr(receiver, "__qualname__", receiver)}: {response!r}'
+            for receiver, response in responses if isinstance(response, Exception)
+        ]
+        if errors:
+            raise OutboxDispatchError('; '.join(errors))
+    finally:
+        connection.close()
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to `batch_size` due events. The lease is a push of `available_at`,
+    so events of a worker that dies are picked up again once it expires.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEvent.EVENT_STATUS_PENDING, available_at__lte=now)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        OutboxEvent.objects.filter(id__in=ids).update(available_at=now + LEASE, attempts=F('attempts') + 1)
+    return list(OutboxEvent.objects.filter(id__in=ids).order_by('id'))
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def process_batch(batch_size=100, workers=4, max_attempts=5):
+    """Dispatch one batch of events. Returns (done, retried, dead) counts."""
+    events = claim_batch(batch_size)
+    if not events:
+        return 0, 0, 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(event, executor.submit(dispatch, event)) for event in events]
+        done = []
+        failed = []
+        for event, future in futures:
+            error = future.exception()
+            if error is None:
+                done.append(event.id)
+            else:
+                failed.append((event, error))
+
+    now = timezone.now()
+    OutboxEvent.objects.filter(id__in=done).update(status=OutboxEvent.EVENT_STATUS_DONE, datetime_processed=now, last_error='')
+    dead = 0
+    for event, error in failed:
+        if event.attempts >= max_attempts:
+            dead += 1
+            OutboxEvent.objects.filter(id=event.id).update(
+                status=OutboxEvent.EVENT_STATUS_DEAD, datetime_processed=now, last_error=repr(error),
+            )
+        else:
+            OutboxEvent.objects.filter(id=event.id).update(available_at=now + backoff(event.attempts), last_error=repr(error))
+    return len(done), len(failed) - dead, dead
+
+
+def prune(older_than, chunk_size=PRUNE_CHUNK_SIZE):
+    """Delete done events processed more than `older_than` ago, in chunks. Dead events are kept for inspection."""
+    cutoff = timezone.now() - older_than
+    deleted = 0
+    while True:
+        ids = list(
+            OutboxEvent.objects.filter(status=OutboxEvent.EVENT_STATUS_DONE, datetime_processed__lt=cutoff)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return deleted
+        deleted += OutboxEvent.objects.filter(id__in=ids).delete()[0]
@@ -1,5 +1,217 @@
-from rest_framework.pagination import PageNumberPagination
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination, Cursor
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PositionEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder truncates datetimes to milliseconds; a seek needs the exact value.
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
-    
\ No newline at end of file
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full ordering (plus a unique tiebreaker)
+    instead of an offset, so every page costs one indexed range scan and no COUNT(*).
+    Works with the ordering chosen through OrderingFilter.
+    """
+    page_size = 10
+    ordering = 'id'
+    tiebreaker = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        # An ordering the filters already applied (e.g. search relevance) wins over the default.
+        ordering = queryset.query.order_by
+        if not ordering or not all(isinstance(field, str) and '__' not in field for field in ordering):
+            ordering = super().get_ordering(request, queryset, view)
+        ordering = list(ordering)
+        if not any(field.lstrip('-') == self.tiebreaker for field in ordering):
+            prefix = '-' if ordering[0].startswith('-') else ''
+            ordering.append(prefix + self.tiebreaker)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = [self._invert(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None and self.cursor.position is not None:
+            values = self._decode_position(self.cursor.position, queryset)
+            queryset = queryset.filter(self._seek(ordering, values))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None and self.cursor.position is not None
+
+        if self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._encode_position(self.page[0])))
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _seek(ordering, values):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for index, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{field.lstrip("-")}__{lookup}': values[index]})
+            for previous_field, previous_value in zip(ordering[:index], values[:index]):
+                step &= Q(**{previous_field.lstrip('-'): previous_value})
+            condition |= step
+        return condition
+
+    def _encode_position(self, instance):
+        values = [getattr(instance, field.lstrip('-')) for field in self.ordering]
+        return json.dumps(values, cls=PositionEncoder)
+
+    def _decode_position(self, position, queryset):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # Cursors come from the client, so each value must be a valid one for its field.
+        try:
+            values = [self._get_field(queryset, field).to_python(value) for field, value in zip(self.ordering, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(value is None for value in values):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def _get_field(queryset, field):
+        name = field.lstrip('-')
+        try:
+            return queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # An annotation, e.g. the search relevance.
+            return queryset.query.annotations[name].output_field
+
+
+class OrderPagination(KeysetPagination):
+    ordering = '-datetime_created'
+
+
+class CommentPagination(KeysetPagination):
+    # With the product and status filters this walks the (product, status, datetime_created) index.
+    ordering = '-datetime_created'
+
+
+class ProductPagination(DefaultPagination):
+    """
+    Page number pagination by default. Passing `cursor` (empty to start) switches
+    to keyset pagination, and `count=false` skips the COUNT(*) of page number mode.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if not queryset.ordered:
+            # OFFSET pages are only stable over a total ordering.
+            queryset = queryset.order_by('id')
+        self.with_count = request.query_params.get(self.count_query_param, '').lower() not in ('0', 'false', 'no')
+
+        if self.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            self.keyset.page_size = self.page_size
+            page = self.keyset.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.keyset.display_page_controls
+            return page
+
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=self.page_number, message='Invalid page.'))
+
+        offset = (self.page_number - 1) * page_size
+        results = list(queryset[offset:offset + page_size + 1])
+        self.uncounted_has_next = len(results) > page_size
+        return results[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        if self.with_count:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if self.with_count:
+            return super().get_next_link()
+        if not self.uncounted_has_next:
+            return None
+        return self._page_link(self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.with_count:
+            return super().get_previous_link()
+        if self.page_number <= 1:
+            return None
+        return self._page_link(self.page_number - 1)
+
+    def _page_link(self, page_number):
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, page_number)
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
@@ -0,0 +1,178 @@
+"""
+Read/write routing between the primary (`default`) and the read replicas named in
+STORE_READ_REPLICAS. ReplicaMiddleware sends the reads of GET/HEAD requests to the
+store views to one replica, picked per request. Everything else reads from the
+primary, and so do:
+
+- reads inside `transaction.atomic` on the primary,
+- reads inside `use_primary()`, which wraps every read that refills a cache so a
+  lagging replica's rows are never cached under a version bumped after a write,
+- reads after the request has written anything,
+- every request from a client that wrote in the last STORE_REPLICA_STICKY_SECONDS,
+  so clients read their own writes while the replicas catch up.
+
+Writes always go to the primary. Streamed response bodies keep the request's routing
+while they are iterated.
+"""
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_METHODS = ('GET', 'HEAD')
+STICKY_KEY = 'store:primary:{}'
+DEFAULT_STICKY_SECONDS = 5
+
+
+class RoutingState:
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+        self.primary = False
+
+
+routing_state = ContextVar('store_routing_state', default=None)
+
+
+@contextmanager
+def use_primary():
+    """Send the reads inside to the primary, whatever the request's routing."""
+    state = routing_state.get()
+    if state is None:
+        yield
+        return
+    primary, state.primary = state.primary, True
+    try:
+        yield
+    finally:
+        state.primary = primary
+
+
+def stream_with_routing(content, state):
+    # Each chunk is produced with the request's routing, without leaving it set between chunks.
+    content = iter(content)
+    while True:
+        token = routing_state.set(state)
+        try:
+            chunk = next(content)
+        except StopIteration:
+            return
+        finally:
+            routing_state.reset(token)
+        yield chunk
+
+
+async def astream_with_routing(content, state):
+    content = aiter(content)
+    while True:
+        token = routing_state.set(state)
+        try:
+            chunk = await anext(content)
+        except StopAsyncIteration:
+            return
+        finally:
+            routing_state.reset(token)
+        yield chunk
+
+
+def get_replicas():
+    return getattr(settings, 'STORE_READ_REPLICAS', [])
+
+
+def get_sticky_key(request):
+    # Clients are told apart by their credentials, or their address when anonymous.
+    client = request.META.get('HTTP_AUTHORIZATION') or request.META.get('REMOTE_ADDR', '')
+    return STICKY_KEY.format(hashlib.md5(client.encode()).hexdigest())
+
+
+def is_store_view(view_func):
+    # DRF's as_view() copies the viewset's module onto the view function.
+    return getattr(view_func, '__module__', '').startswith('store.')
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or state.replica is None or state.wrote or state.primary:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        # Not None: Django would fall back to the database the instance was read from.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """Scopes ReplicaRouter's routing to a request and records clients that wrote."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+            self.finish(request, state)
+        return self.route_stream(response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+            self.finish(request, state)
+        return self.route_stream(response, state)
+
+    @staticmethod
+    def route_stream(response, state):
+        # Streamed bodies are produced after the view returns, outside the request's routing.
+        if state.replica is not None and response.streaming:
+            stream = astream_with_routing if response.is_async else stream_with_routing
+            response.streaming_content = stream(response.streaming_content, state)
+        return response
+
+    @staticmethod
+    def finish(request, state):
+        if state.wrote and get_replicas():
+            sticky_seconds = getattr(settings, 'STORE_REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+            cache.set(get_sticky_key(request), True, sticky_seconds)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = get_replicas()
+        state = routing_state.get()
+        if not replicas or state is None or request.method not in REPLICA_METHODS or not is_store_view(view_func):
+            return
+        if cache.get(get_sticky_key(request)) is None:
+            state.replica = random.choice(replicas)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return self.__class__.process_view(self, request, view_func, view_args, view_kwargs)
@@ -0,0 +1,141 @@
+import math
+import re
+from collections import Counter
+from functools import reduce
+from operator import and_
+
+from django.db import connections, router
+from django.db.models import Q, F, Sum, Case, When, Value, FloatField, OuterRef, Subquery, Count
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from rest_framework.filters import SearchFilter
+
+from .models import Category, Product, ProductSearchTerm
+from .cache import get_category_product_counts
+
+FULLTEXT_VENDORS = ('mysql',)
+FULLTEXT_INDEX_NAME = 'store_product_fulltext'
+
+TOKEN_RE = re.compile(r'\w+')
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+INDEX_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())
+        if len(token) >= MIN_TERM_LENGTH
+    ]
+
+
+def uses_fulltext(using):
+    return connections[using].vendor in FULLTEXT_VENDORS
+
+
+def build_product_terms(product):
+    weights = Counter()
+    for term in tokenize(product.name):
+        weights[term] += NAME_WEIGHT
+    for term in tokenize(product.description):
+        weights[term] += DESCRIPTION_WEIGHT
+    return [ProductSearchTerm(product_id=product.id, term=term, weight=weight) for term, weight in weights.items()]
+
+
+def index_products(products):
+    """Replace the inverted index rows of the given products. No-op where the database has FULLTEXT."""
+    using = router.db_for_write(ProductSearchTerm)
+    if uses_fulltext(using):
+        return
+    products = list(products)
+    ProductSearchTerm.objects.using(using).filter(product_id__in=[product.id for product in products]).delete()
+    terms = [term for product in products for term in build_product_terms(product)]
+    ProductSearchTerm.objects.using(using).bulk_create(terms, batch_size=INDEX_BATCH_SIZE)
+
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE):
+    using = router.db_for_write(ProductSearchTerm)
+    if uses_fulltext(using):
+        return 0
+    ProductSearchTerm.objects.using(using).all().delete()
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = list(Product.objects.using(using).filter(id__gt=last_id).order_by('id').only('id', 'name', 'description')[:batch_size])
+        if not batch:
+            return indexed
+        ProductSearchTerm.objects.using(using).bulk_create(
+            [term for product in batch for term in build_product_terms(product)], batch_size=batch_size
+        )
+        indexed += len(batch)
+        last_id = batch[-1].id
+
+
+def search_fulltext(queryset, terms):
+    quote_name = connections[queryset.db].ops.quote_name
+    table = quote_name(Product._meta.db_table)
+    match = RawSQL(
+        f'MATCH ({table}.{quote_name("name")}, {table}.{quote_name("description")}) '
+        f'AGAINST (%s IN NATURAL LANGUAGE MODE)',
+        (' '.join(terms),),
+        output_field=FloatField(),
+    )
+    queryset = queryset.annotate(search_rank=match)
+    return queryset, Q(search_rank__gt=0)
+
+
+def search_inverted_index(queryset, terms):
+    # tf * idf, where the corpus size comes from the cached per-category counts.
+    total = sum(get_category_product_counts().values()) or 1
+    document_frequencies = dict(
+        ProductSearchTerm.objects.using(queryset.db).filter(term__in=terms)
+        .values('term').annotate(df=Count('id')).values_list('term', 'df')
+    )
+    if not document_frequencies:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())), Q(pk__in=[])
+
+    rank = Sum(Case(
+        *[When(term=term, then=F('weight') * Value(math.log(1 + total / df))) for term, df in document_frequencies.items()],
+        output_field=FloatField(),
+    ))
+    matches = ProductSearchTerm.objects.filter(term__in=document_frequencies)
+    ranks = matches.filter(product_id=OuterRef('pk')).order_by().values('product_id').annotate(rank=rank).values('rank')
+    queryset = queryset.annotate(search_rank=Coalesce(Subquery(ranks), Value(0.0), output_field=FloatField()))
+    return queryset, Q(pk__in=matches.values('product_id'))
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Relevance ranked product search over name and description: MySQL FULLTEXT where
+    available, the ProductSearchTerm inverted index elsewhere. Products whose category
+    title contains the search text match as well. Results are ordered by rank unless
+    the client asked for an explicit ordering.
+    """
+    ordering_param = 'ordering'
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        terms = sorted({term for search_term in search_terms for term in tokenize(search_term)})
+        if not terms:
+            return queryset
+
+        if uses_fulltext(queryset.db):
+            queryset, matches = search_fulltext(queryset, terms)
+        else:
+            queryset, matches = search_inverted_index(queryset, terms)
+
+        # Categories are few, so resolving title matches up front keeps the product scan index-only.
+        category_ids = list(
+            Category.objects.using(queryset.db)
+            .filter(reduce(and_, [Q(title__icontains=term) for term in search_terms]))
+            .values_list('id', flat=True)
+        )
+        if category_ids:
+            matches |= Q(category_id__in=category_ids)
+        queryset = queryset.filter(matches)
+
+        if not request.query_params.get(self.ordering_param):
+            queryset = queryset.order_by('-search_rank', 'id')
+        return queryset
@@ -1,33 +1,65 @@
+from decimal import Decimal
+
 from rest_framework import serializers
+from django.utils import timezone
 from django.utils.text import slugify
 from django.db import transaction
+from django.db.models import Case, When, F, Q
 
-from .models import Category, Product, Comment, Cart, CartItem, Customer, Order, OrderItem
-
-DOLLAR_TO_RIAL = 600000
+from .models import Category, Product, Comment, Cart, CartItem, Customer, Order, OrderItem, ProductCommentStats
+from .cache import get_category_product_counts, get_customer, bump_resource_version, PRODUCTS
+from .carts import get_cart_store
+from .outbox import publish, ORDER_CREATION
+from .currencies import get_rates, get_converter, RIAL
 
 class CategorySerializer(serializers.ModelSerializer):
-    # number_of_products = serializers.SerializerMethodField()
-    number_of_products = serializers.IntegerField(source='product.count', read_only=True)
+    number_of_products = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
         fields = ['id', 'title', 'description', 'number_of_products']
 
-    # def get_number_of_products(self, category):
-    #     return category.products.count()
+    def get_number_of_products(self, category):
+        product_counts = self.context.get('product_counts')
+        if product_counts is None:
+            product_counts = get_category_product_counts()
+        return product_counts.get(category.id, 0)
 
 
 class ProductSerializer(serializers.ModelSerializer):
     rial_unit_price = serializers.SerializerMethodField()
+    currency = serializers.SerializerMethodField()
+    converted_unit_price = serializers.SerializerMethodField()
     # category = CategorySerializer()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'unit_price', 'rial_unit_price', 'category', 'inventory', 'description']
+        fields = ['id', 'name', 'unit_price', 'rial_unit_price', 'currency', 'converted_unit_price', 'category',
+                  'inventory', 'description']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Converters are built once per serializer, i.e. once per page, not for every product.
+        rates = self.context['rates'] if 'rates' in self.context else get_rates()
+        self.rial_converter = get_converter(RIAL, rates)
+        currency = self.context.get('currency')
+        self.converter = get_converter(currency, rates) if currency else None
+        if currency and self.converter is None:
+            raise serializers.ValidationError({'currency': [f'Unknown currency {currency}.']})
+        if self.converter is None:
+            self.fields.pop('currency')
+            self.fields.pop('converted_unit_price')
 
     def get_rial_unit_price(self, product):
-        return int(product.unit_price*DOLLAR_TO_RIAL)
+        if self.rial_converter is None:
+            return None
+        return self.rial_converter.convert(product.unit_price)
+
+    def get_currency(self, product):
+        return self.converter.code
+
+    def get_converted_unit_price(self, product):
+        return self.converter.convert(product.unit_price)
 
     def create(self, validated_data):
         product = Product(**validated_data)
@@ -36,6 +68,26 @@ class ProductSerializer(serializers.ModelSerializer):
         return product
 
 
+class BulkProductSerializer(serializers.ModelSerializer):
+    """One row of a bulk product write; categories are checked against ids loaded up front."""
+    id = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(source='category_id')
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'unit_price', 'category', 'inventory', 'description']
+
+    def validate_category(self, category_id):
+        if category_id not in self.context['category_ids']:
+            raise serializers.ValidationError(f'Invalid pk "{category_id}" - object does not exist.')
+        return category_id
+
+
+class InventoryDeltaSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    delta = serializers.IntegerField()
+
+
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
@@ -46,6 +98,12 @@ class CommentSerializer(serializers.ModelSerializer):
         return Comment.objects.create(product_id=product_id, **validated_data)
 
 
+class ProductCommentStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductCommentStats
+        fields = ['approved_count', 'pending_count']
+
+
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
@@ -68,13 +126,7 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         cart_id = self.context['cart_pk']
         product = validated_data.get('product')
         quantity = validated_data.get('quantity')
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product.id)
-            cart_item.quantity += quantity
-            cart_item.save()
-        except CartItem.DoesNotExist:
-            cart_item = CartItem.objects.create(cart_id=cart_id, **validated_data)
-        return cart_item
+        return get_cart_store().add_item(cart_id, product, quantity)
 
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
@@ -82,6 +134,9 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['quantity']
 
+    def update(self, instance, validated_data):
+        return get_cart_store().update_item(instance, validated_data['quantity'])
+
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = CartProductSerializer()
@@ -92,7 +147,10 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'cart', 'quantity', 'item_total_price']
 
     def get_item_total_price(self, item):
-        return int(item.quantity*item.product.unit_price)
+        total_price = getattr(item, 'total_price', None)
+        if total_price is None:
+            total_price = item.quantity * item.product.unit_price
+        return total_price
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -105,11 +163,16 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'items']
 
     def get_total_cart_price(self, cart):
-        price = 0
-        items = cart.items.all()
-        for item in items:
-            price += int(item.quantity*item.product.unit_price)
-        return price
+        total_price = getattr(cart, 'total_price', None)
+        if total_price is None:
+            total_price = sum((item.quantity * item.product.unit_price for item in cart.items.all()), Decimal(0))
+        return total_price
+
+
+class CartSummarySerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    items_count = serializers.IntegerField()
+    total_cart_price = serializers.DecimalField(max_digits=14, decimal_places=2, source='total_price')
 
 
 # ************************* Order Serializers ****************************** #
@@ -132,7 +195,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'status', 'datetime_created', 'items']
+        fields = ['id', 'customer', 'status', 'datetime_created', 'items_count', 'total_amount', 'items']
 
 
 class OrderAdminSerializer(serializers.ModelSerializer):
@@ -141,42 +204,88 @@ class OrderAdminSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'status', 'datetime_created', 'items']
+        fields = ['id', 'customer', 'status', 'datetime_created', 'items_count', 'total_amount', 'items']
+
+
+class InsufficientInventory(Exception):
+    """Raised by checkout with one `{'product', 'requested', 'available'}` report per short product."""
+
+    def __init__(self, shortfalls):
+        super().__init__(shortfalls)
+        self.shortfalls = shortfalls
 
 
 class OrderCreateSerializer(serializers.Serializer):
-    with transaction.atomic():
-        cart_id = serializers.UUIDField()
-
-        def validate_cart_id(self, cart_id):
-            if Cart.objects.filter(id=cart_id).exists():
-                raise serializers.ValidationError('Cart does not exist')
-            if Cart.objects.filter(cart_id=cart_id).count() == 0:
-                raise serializers.ValidationError('Cart is empty')
-            return cart_id
-
-        def save(self):
-            cart_id = self.validated_data['cart_id']
-            user_id = self.context['user_id']
-            customer = Customer.objects.get(id=user_id)
-
-            order = Order()
-            order.customer = customer
-            order.save()
-
-            cart_items = CartItem.objects.filter(cart_id=cart_id)
-            order_items = []
-            for item in cart_items:
-                order_item = OrderItem()
-                order_item.order = order
-                order_item.product_id = item.product_id
-                order_item.quantity = item.quantity
-                order_item.unit_price = item.product.unit_price
-                order_items.append(order_item)
-            OrderItem.objects.bulk_create(order_items)
-            CartItem.objects.filter(id=cart_id).delete()
-
-            return order
+    cart_id = serializers.UUIDField()
+
+    def validate_cart_id(self, cart_id):
+        get_cart_store().flush(cart_id)
+        if not Cart.objects.filter(id=cart_id).exists():
+            raise serializers.ValidationError('Cart does not exist')
+        if not CartItem.objects.filter(cart_id=cart_id).exists():
+            raise serializers.ValidationError('Cart is empty')
+        return cart_id
+
+    @staticmethod
+    def get_shortfalls(quantities, inventories):
+        return [
+            {'product': product_id, 'requested': quantity, 'available': inventories.get(product_id, 0)}
+            for product_id, quantity in sorted(quantities.items())
+            if inventories.get(product_id, 0) < quantity
+        ]
+
+    def reserve_inventory(self, quantities):
+        # Rows are locked in primary key order so concurrent checkouts can not deadlock.
+        locked_products = Product.objects.select_for_update().filter(id__in=quantities).order_by('id')
+        prices = {}
+        inventories = {}
+        for product_id, inventory, unit_price in locked_products.values_list('id', 'inventory', 'unit_price'):
+            inventories[product_id] = inventory
+            prices[product_id] = unit_price
+
+        shortfalls = self.get_shortfalls(quantities, inventories)
+        if shortfalls:
+            raise InsufficientInventory(shortfalls)
+
+        # One conditional UPDATE for the whole cart; a row only matches while it still has enough stock.
+        in_stock = Q()
+        for product_id, quantity in quantities.items():
+            in_stock |= Q(id=product_id, inventory__gte=quantity)
+        updated = Product.objects.filter(in_stock).update(inventory=Case(
+            *[When(id=product_id, then=F('inventory') - quantity) for product_id, quantity in quantities.items()],
+            default=F('inventory'),
+        ), datetime_modified=timezone.now())
+        if updated != len(quantities):
+            inventories = dict(Product.objects.filter(id__in=quantities).values_list('id', 'inventory'))
+            raise InsufficientInventory(self.get_shortfalls(quantities, inventories))
+        # A queryset update sends no post_save, so cached product reads are dropped here.
+        transaction.on_commit(lambda: bump_resource_version(PRODUCTS))
+        return prices
+
+    def save(self, **kwargs):
+        cart_id = self.validated_data['cart_id']
+        user_id = self.context['user_id']
+
+        with transaction.atomic():
+            quantities = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+            prices = self.reserve_inventory(quantities)
+
+            customer = get_customer(user_id)
+            order = Order.objects.create(
+                customer=customer,
+                items_count=len(quantities),
+                total_amount=sum(quantity * prices[product_id] for product_id, quantity in quantities.items()),
+            )
+            publish(ORDER_CREATION, order_id=order.id)
+
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=prices[product_id])
+                for product_id, quantity in quantities.items()
+            ])
+            Cart.objects.filter(id=cart_id).delete()
+            transaction.on_commit(lambda: get_cart_store().discard(cart_id))
+
+        return order
 
 
 class OrderUpdateSerializer(serializers.ModelSerializer):
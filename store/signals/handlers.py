@@ -1,10 +1,108 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
+from django.db import transaction
+from django.db.models import F
 from django.conf import settings
 
-from store.models import Customer
+from core.authentication import invalidate_cached_user
+from store.models import (Customer, Product, Category, CartItem, Order, OrderItem, CurrencyRate, Comment,
+                          ProductCommentStats)
+from store.search import index_products
+from store.cache import (invalidate_product_caches, invalidate_cart_summary, invalidate_customer,
+                         bump_resource_version, PRODUCTS, CATEGORIES, CURRENCIES)
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_profile_for_newly_created_user(sender, instance, created, **kwargs):
     if created:
         Customer.objects.create(user=instance)
+
+
+# Cached users and customers are dropped right away and again on commit,
+# so a read racing the transaction can not keep the old row cached.
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_on_change(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+    transaction.on_commit(lambda: invalidate_cached_user(instance.pk))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_customer_on_change(sender, instance, **kwargs):
+    invalidate_customer(instance.user_id)
+    transaction.on_commit(lambda: invalidate_customer(instance.user_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_caches_on_product_change(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_product_caches)
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_products([instance])
+
+
+# Product search matches on category__title, so category changes reach product reads too.
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_caches_on_category_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_resource_version(CATEGORIES, PRODUCTS))
+
+
+@receiver(m2m_changed, sender=Product.discounts.through)
+def invalidate_caches_on_product_discounts_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_resource_version(PRODUCTS))
+
+
+# Product responses carry converted prices.
+@receiver(post_save, sender=CurrencyRate)
+@receiver(post_delete, sender=CurrencyRate)
+def invalidate_caches_on_currency_rate_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_resource_version(CURRENCIES, PRODUCTS))
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary_on_item_change(sender, instance, **kwargs):
+    cart_id = instance.cart_id
+    transaction.on_commit(lambda: invalidate_cart_summary(cart_id))
+
+
+# Version columns back the ETags of conditional GETs; the UPDATE is atomic, so concurrent saves both count.
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Order)
+def bump_version_on_save(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        sender.objects.filter(pk=instance.pk).update(version=F('version') + 1)
+
+
+# Runs inside the caller's transaction so the stored totals never disagree with the committed items.
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_order_totals_on_item_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Order.objects.refresh_totals([instance.order_id])
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = (instance.product_id, instance.status)
+    old = getattr(instance, '_loaded_values', None)
+    if created:
+        ProductCommentStats.objects.record_change(new=new)
+    elif old is None:
+        ProductCommentStats.objects.refresh([instance.product_id])
+    else:
+        ProductCommentStats.objects.record_change(old, new)
+    instance._loaded_values = new
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_stats_on_delete(sender, instance, **kwargs):
+    ProductCommentStats.objects.record_change(old=getattr(instance, '_loaded_values', (instance.product_id, instance.status)))
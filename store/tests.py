@@ -1,3 +1,706 @@
-from django.test import TestCase
+import json
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.mixins import ListModelMixin
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import CustomUser
+from . import outbox
+from .admin import EstimatedCountPaginator, ProductAdmin
+from .cache import get_resource_version, PRODUCTS, CATEGORIES
+from .carts import get_cart_store
+from .currencies import get_rates, RIAL
+from .factories import CategoryFactory, DiscountFactory, ProductFactory
+from .fast_serializers import ValuesListMixin
+from .models import Cart, CartItem, Comment, CurrencyRate, Order, OrderItem, OutboxEvent, Product, ProductCommentStats
+from .outbox import ORDER_CREATION
+from .paginations import OrderPagination
+from .renderers import ORJSONRenderer
+from .replicas import ReplicaRouter, RoutingState, routing_state, use_primary
+from .serializers import OrderCreateSerializer
+from .signals import order_creation
+from .views import ProductModelViewSet
+
+
+class StoreTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(REMOTE_ADDR='192.0.2.1')
+        self.category = CategoryFactory()
+        self.product = ProductFactory(category=self.category, name='Old name')
+
+
+class ResponseCacheTests(StoreTestCase):
+    def detail(self):
+        return self.client.get(f'/store/products/{self.product.id}/').json()
+
+    def assert_bumps(self, resources, change):
+        versions = [get_resource_version(resource) for resource in resources]
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        for resource, version in zip(resources, versions):
+            self.assertNotEqual(get_resource_version(resource), version, resource)
+
+    def test_product_reads_are_served_from_cache(self):
+        self.assertEqual(self.detail()['name'], 'Old name')
+        # A queryset update sends no signal, so the cached response survives it.
+        Product.objects.filter(pk=self.product.pk).update(name='New name')
+        self.assertEqual(self.detail()['name'], 'Old name')
+
+    def test_product_save_invalidates_cached_reads(self):
+        self.assertEqual(self.detail()['name'], 'Old name')
+        self.product.name = 'New name'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.detail()['name'], 'New name')
+
+    def test_category_list_is_cached(self):
+        categories = self.client.get('/store/categories/').json()
+        CategoryFactory()
+        self.assertEqual(self.client.get('/store/categories/').json(), categories)
+
+    def test_product_save_and_delete_bump_versions(self):
+        self.assert_bumps([PRODUCTS, CATEGORIES], self.product.save)
+        self.assert_bumps([PRODUCTS, CATEGORIES], self.product.delete)
+
+    def test_category_save_and_delete_bump_versions(self):
+        category = CategoryFactory()
+        self.assert_bumps([CATEGORIES, PRODUCTS], category.save)
+        self.assert_bumps([CATEGORIES, PRODUCTS], category.delete)
+
+    def test_discount_changes_bump_products_version(self):
+        discount = DiscountFactory()
+        self.assert_bumps([PRODUCTS], lambda: self.product.discounts.add(discount))
+        self.assert_bumps([PRODUCTS], lambda: self.product.discounts.remove(discount))
+        self.product.discounts.add(discount)
+        self.assert_bumps([PRODUCTS], self.product.discounts.clear)
+
+    def test_clear_inventory_bumps_versions(self):
+        admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+        request = RequestFactory().post('/admin/store/product/')
+        request.user = admin
+        model_admin = ProductAdmin(Product, site)
+        model_admin.message_user = lambda *args, **kwargs: None
+        self.assert_bumps([PRODUCTS, CATEGORIES], lambda: model_admin.clear_inventory(request, Product.objects.all()))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).inventory, 0)
+
+
+@override_settings(STORE_CART_BACKEND='store.carts.CacheCartStore', STORE_CART_OPTIONS={'flush_interval': 3600})
+class CacheCartStoreTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart_id = self.client.post('/store/carts/').json()['id']
+        self.items_url = f'/store/carts/{self.cart_id}/items/'
+
+    def add_item(self, quantity=1):
+        return self.client.post(self.items_url, {'product': self.product.id, 'quantity': quantity}, format='json').json()
+
+    def test_items_keep_their_database_ids(self):
+        item = self.add_item()
+        self.assertEqual(item['id'], CartItem.objects.get(cart_id=self.cart_id).id)
+        self.assertEqual(self.add_item(2)['id'], item['id'])
+        get_cart_store().flush(self.cart_id)
+        with override_settings(STORE_CART_BACKEND='store.carts.DatabaseCartStore', STORE_CART_OPTIONS={}):
+            items = self.client.get(self.items_url).json()
+        self.assertEqual([(item['id'], 3)], [(row['id'], row['quantity']) for row in items])
+
+    def test_quantity_changes_are_written_back(self):
+        item = self.add_item()
+        self.client.patch(f'{self.items_url}{item["id"]}/', {'quantity': 5}, format='json')
+        self.assertEqual(CartItem.objects.get(pk=item['id']).quantity, 1)
+        self.assertEqual(get_cart_store().flush_all(), 1)
+        self.assertEqual(CartItem.objects.get(pk=item['id']).quantity, 5)
+        self.assertEqual(get_cart_store().flush_all(), 0)
+
+    def test_removed_items_are_deleted_on_write_back(self):
+        item = self.add_item()
+        self.client.delete(f'{self.items_url}{item["id"]}/')
+        self.assertEqual(self.client.get(self.items_url).json(), [])
+        get_cart_store().flush(self.cart_id)
+        self.assertFalse(CartItem.objects.filter(pk=item['id']).exists())
+
+
+class CartSummaryTests(StoreTestCase):
+    def summaries(self):
+        Product.objects.filter(pk=self.product.pk).update(unit_price=Decimal('4.25'))
+        cart_id = self.client.post('/store/carts/').json()['id']
+        empty = self.client.get(f'/store/carts/{cart_id}/summary/').json()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/store/carts/{cart_id}/items/', {'product': self.product.id, 'quantity': 2}, format='json')
+        filled = self.client.get(f'/store/carts/{cart_id}/summary/').json()
+        return [(summary['items_count'], summary['total_cart_price']) for summary in [empty, filled]]
+
+    def test_database_store(self):
+        self.assertEqual(self.summaries(), [(0, 0.0), (1, 8.5)])
+
+    @override_settings(STORE_CART_BACKEND='store.carts.CacheCartStore', STORE_CART_OPTIONS={'flush_interval': 3600})
+    def test_cache_store(self):
+        self.assertEqual(self.summaries(), [(0, 0.0), (1, 8.5)])
+
+
+class CheckoutTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='secret')
+        self.client.force_authenticate(self.user)
+
+    def create_cart(self, quantities):
+        cart_id = self.client.post('/store/carts/').json()['id']
+        for product, quantity in quantities.items():
+            self.client.post(f'/store/carts/{cart_id}/items/', {'product': product.id, 'quantity': quantity}, format='json')
+        return cart_id
+
+    def checkout(self, cart_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/store/orders/', {'cart_id': cart_id}, format='json')
+
+    def test_checkout_reserves_inventory(self):
+        other = ProductFactory(category=self.category, inventory=5, unit_price=Decimal('2.50'))
+        Product.objects.filter(pk=self.product.pk).update(inventory=10, unit_price=Decimal('10.00'))
+        cart_id = self.create_cart({self.product: 3, other: 2})
+        response = self.checkout(cart_id)
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual((order.items_count, order.total_amount), (2, Decimal('35.00')))
+        inventories = dict(Product.objects.values_list('id', 'inventory'))
+        self.assertEqual((inventories[self.product.id], inventories[other.id]), (7, 3))
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+
+    def test_shortfall_leaves_stock_and_cart_alone(self):
+        other = ProductFactory(category=self.category, inventory=5)
+        Product.objects.filter(pk=self.product.pk).update(inventory=10)
+        cart_id = self.create_cart({self.product: 3, other: 4})
+        Product.objects.filter(pk=other.pk).update(inventory=1)
+        response = self.checkout(cart_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {'inventory': [{'product': other.id, 'requested': 4, 'available': 1}]})
+        inventories = dict(Product.objects.values_list('id', 'inventory'))
+        self.assertEqual((inventories[self.product.id], inventories[other.id]), (10, 1))
+        self.assertEqual(CartItem.objects.filter(cart_id=cart_id).count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        products = ProductFactory.create_batch(10, category=self.category, inventory=50)
+        query_counts = []
+        for size in [2, 10]:
+            cart_id = self.create_cart({product: 1 for product in products[:size]})
+            cache.clear()
+            with CaptureQueriesContext(connections['default']) as queries:
+                self.assertEqual(self.checkout(cart_id).status_code, 201)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class OutboxTests(TransactionTestCase):
+    # Events are dispatched from worker threads, which only see committed rows.
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='secret')
+        self.product = ProductFactory(category=CategoryFactory(), inventory=10)
+        # core's own order_creation receiver prints every order.
+        patcher = mock.patch('core.signals.print', create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_order(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        serializer = OrderCreateSerializer(data={'cart_id': str(cart.id)}, context={'user_id': self.user.id})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def receive(self, error=None):
+        received = []
+
+        def receiver(sender, order, **kwargs):
+            received.append(order.id)
+            if error is not None:
+                raise error
+
+        order_creation.connect(receiver, weak=False)
+        self.addCleanup(order_creation.disconnect, receiver)
+        return received
+
+    def test_event_is_written_in_the_order_transaction(self):
+        order = self.create_order()
+        self.assertEqual(list(OutboxEvent.objects.values_list('event', 'payload')), [(ORDER_CREATION, {'order_id': order.id})])
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create_order()
+        self.assertEqual((Order.objects.count(), OutboxEvent.objects.count()), (1, 1))
+
+    def test_dispatched_events_are_done(self):
+        received = self.receive()
+        order = self.create_order()
+        self.assertEqual(outbox.process_batch(max_attempts=2), (1, 0, 0))
+        self.assertEqual(received, [order.id])
+        self.assertEqual(OutboxEvent.objects.get().status, OutboxEvent.EVENT_STATUS_DONE)
+        self.assertEqual(outbox.process_batch(), (0, 0, 0))
+
+    def test_failing_receiver_is_retried_then_dead_lettered(self):
+        received = self.receive(ValueError('mail server down'))
+        self.create_order()
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 1, 0))
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.EVENT_STATUS_PENDING, 1))
+        self.assertIn('mail server down', event.last_error)
+        # Backing off until available_at.
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 0, 0))
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.EVENT_STATUS_DEAD, 2))
+        self.assertEqual(len(received), 2)
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 0, 0))
+
+    def test_expired_leases_are_claimed_again(self):
+        self.create_order()
+        self.assertEqual(len(outbox.claim_batch(10)), 1)
+        self.assertEqual(outbox.claim_batch(10), [])
+        # The worker holding the lease died.
+        OutboxEvent.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([event.attempts for event in outbox.claim_batch(10)], [2])
+
+    def test_prune_removes_old_done_events(self):
+        self.receive()
+        for _ in range(3):
+            self.create_order()
+        outbox.process_batch()
+        old = timezone.now() - timedelta(days=8)
+        OutboxEvent.objects.filter(id__in=OutboxEvent.objects.order_by('id').values('id')[:2]).update(datetime_processed=old)
+        dead = OutboxEvent.objects.create(event=ORDER_CREATION, status=OutboxEvent.EVENT_STATUS_DEAD, datetime_processed=old)
+        self.assertEqual(outbox.prune(timedelta(days=7), chunk_size=1), 2)
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+        self.assertTrue(OutboxEvent.objects.filter(pk=dead.pk).exists())
+
+
+class BulkProductTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='admin'))
+
+    def post(self, url, rows):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def new_row(self, name, inventory=1, **fields):
+        return {'name': name, 'unit_price': '9.99', 'category': self.category.id, 'inventory': inventory, 'description': name, **fields}
+
+    def test_mixed_batch_gets_a_result_per_row(self):
+        data = self.post('/store/products/bulk/', [
+            self.new_row('First new'),
+            self.new_row('Bad category', category=0),
+            {'id': self.product.id, 'name': 'Renamed'},
+            {'id': 0, 'name': 'Missing'},
+            'not a row',
+            self.new_row('Second new', inventory=2),
+        ])
+        self.assertEqual((data['created'], data['updated'], data['error']), (2, 1, 3))
+        results = data['results']
+        self.assertEqual([result['index'] for result in results], list(range(6)))
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'updated', 'error', 'error', 'created'])
+        self.assertIn('category', results[1]['errors'])
+        self.assertIn('id', results[3]['errors'])
+        created = Product.objects.in_bulk([results[0]['id'], results[5]['id']])
+        self.assertEqual(created[results[0]['id']].name, 'First new')
+        self.assertEqual((created[results[5]['id']].name, created[results[5]['id']].slug), ('Second new', 'second-new'))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).name, 'Renamed')
+        self.assertFalse(Product.objects.filter(name__in=['Bad category', 'Missing']).exists())
+
+    def test_ids_are_recovered_without_returning_inserts(self):
+        rows = [self.new_row('Same name' if index % 2 else f'Product {index}', inventory=index) for index in range(12)]
+        with mock.patch.object(type(connections['default'].features), 'can_return_rows_from_bulk_insert', False):
+            with mock.patch('store.bulk.BULK_BATCH_SIZE', 5):
+                results = self.post('/store/products/bulk/', rows)['results']
+        inventories = dict(Product.objects.values_list('id', 'inventory'))
+        self.assertEqual([inventories[result['id']] for result in results], list(range(12)))
+
+    def test_inventory_deltas_are_checked_against_the_running_stock(self):
+        Product.objects.filter(pk=self.product.pk).update(inventory=5)
+        data = self.post('/store/products/inventory/', [
+            {'product': self.product.id, 'delta': -3},
+            {'product': self.product.id, 'delta': -3},
+            {'product': self.product.id, 'delta': 4},
+            {'product': 0, 'delta': 1},
+            {'product': self.product.id, 'delta': 'many'},
+            {'product': self.product.id, 'delta': -6},
+        ])
+        self.assertEqual([result['status'] for result in data['results']], ['updated', 'error', 'updated', 'error', 'error', 'updated'])
+        self.assertEqual([result.get('inventory') for result in data['results']], [2, None, 6, None, None, 0])
+        self.assertEqual(data['results'][1]['errors'], {'delta': ['Only 2 in stock.']})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).inventory, 0)
+
+
+class CommentStatsTests(StoreTestCase):
+    APPROVED = Comment.COMMENT_STATUS_APPROVED
+    WAITING = Comment.COMMENT_STATUS_WAITING
+    REJECTED = Comment.COMMENT_STATUS_NOT_APPROVED
+
+    def setUp(self):
+        super().setUp()
+        self.other_product = ProductFactory(category=self.category)
+
+    def comment(self, status=WAITING, product=None):
+        return Comment.objects.create(product=product or self.product, name='Reader', body='Nice', status=status)
+
+    def stats(self, product=None):
+        return self.client.get(f'/store/products/{(product or self.product).id}/comments/stats/').json()
+
+    def assert_stats(self, product, approved, pending):
+        self.assertEqual(self.stats(product), {'approved_count': approved, 'pending_count': pending})
+        # The counters agree with a recount from the comments table.
+        ProductCommentStats.objects.refresh([product.id])
+        self.assertEqual(self.stats(product), {'approved_count': approved, 'pending_count': pending})
+
+    def test_created_comments_are_counted(self):
+        response = self.client.post(f'/store/products/{self.product.id}/comments/', {'name': 'Reader', 'body': 'Nice'})
+        self.assertEqual(response.status_code, 201)
+        self.comment(self.APPROVED)
+        self.comment(self.REJECTED)
+        self.assert_stats(self.product, 1, 1)
+
+    def test_status_and_product_changes_move_the_comment(self):
+        comment = self.comment()
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.status = self.APPROVED
+        comment.save()
+        self.assert_stats(self.product, 1, 0)
+        comment.product = self.other_product
+        comment.save()
+        self.assert_stats(self.product, 0, 0)
+        self.assert_stats(self.other_product, 1, 0)
+        comment.status = self.REJECTED
+        comment.save()
+        self.assert_stats(self.other_product, 0, 0)
+
+    def test_saving_an_unloaded_comment_recounts(self):
+        comment = self.comment()
+        Comment(
+            pk=comment.pk, product=self.product, name='Reader', body='Edited', status=self.APPROVED,
+            datetime_created=comment.datetime_created,
+        ).save()
+        self.assert_stats(self.product, 1, 0)
+
+    def test_deleted_comments_are_uncounted(self):
+        self.comment(self.APPROVED)
+        comment = self.comment()
+        Comment.objects.get(pk=comment.pk).delete()
+        self.assert_stats(self.product, 1, 0)
+        comment = self.comment(self.APPROVED)
+        comment.delete()
+        self.assert_stats(self.product, 1, 0)
+
+    def test_admin_list_editable_moves_the_comment(self):
+        comments = [self.comment(), self.comment()]
+        admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+        self.client.force_login(admin)
+        data = {'form-TOTAL_FORMS': '2', 'form-INITIAL_FORMS': '2', '_save': 'Save'}
+        for index, (comment, status) in enumerate(zip(comments, [self.APPROVED, self.REJECTED])):
+            data.update({f'form-{index}-id': comment.pk, f'form-{index}-status': status})
+        response = self.client.post('/admin/store/comment/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(Comment.objects.values_list('status', flat=True)), sorted([self.APPROVED, self.REJECTED]))
+        self.assert_stats(self.product, 1, 0)
+
+    def test_only_approved_comments_are_listed(self):
+        approved = self.comment(self.APPROVED)
+        self.comment()
+        self.comment(self.REJECTED)
+        self.comment(self.APPROVED, product=self.other_product)
+        results = self.client.get(f'/store/products/{self.product.id}/comments/').json()['results']
+        self.assertEqual([comment['id'] for comment in results], [approved.id])
+
+
+class InstanceProductViewSet(ProductModelViewSet):
+    """The product list serialised from instances by ProductSerializer, without the response cache."""
+
+    def list(self, request, *args, **kwargs):
+        return ListModelMixin.list(self, request, *args, **kwargs)
+
+
+class ValuesProductViewSet(ProductModelViewSet):
+    def list(self, request, *args, **kwargs):
+        return ValuesListMixin.list(self, request, *args, **kwargs)
+
+
+class ValuesListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categories = CategoryFactory.create_batch(2)
+        for index in range(25):
+            ProductFactory(
+                category=categories[index % 2],
+                name=f'{"Alpha" if index % 3 else "Beta"} product {index}',
+                unit_price=f'{index * 7 % 100}.{index % 10}5',
+                inventory=index % 4,
+            )
+        CurrencyRate.objects.update_or_create(code='EUR', defaults={'rate': '0.9231', 'decimal_places': 2})
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+
+    def render(self, viewset, url):
+        response = viewset.as_view({'get': 'list'})(self.factory.get(url))
+        self.assertEqual(response.status_code, 200)
+        return response.data, JSONRenderer().render(response.data)
+
+    def assert_same_output(self, url):
+        expected_data, expected = self.render(InstanceProductViewSet, url)
+        data, rendered = self.render(ValuesProductViewSet, url)
+        self.assertEqual(rendered, expected, url)
+        return data
+
+    def test_page_number_pagination(self):
+        for url in ['/store/products/', '/store/products/?page=3', '/store/products/?ordering=-inventory&page=2']:
+            self.assert_same_output(url)
+
+    def test_uncounted_pagination(self):
+        for url in ['/store/products/?count=false', '/store/products/?count=false&page=2&ordering=name']:
+            self.assert_same_output(url)
+
+    def test_keyset_pagination(self):
+        for url in ['/store/products/?cursor=', '/store/products/?cursor=&ordering=-inventory']:
+            data = self.assert_same_output(url)
+            while data['next']:
+                data = self.assert_same_output(data['next'])
+
+    def test_search(self):
+        for url in ['/store/products/?search=alpha', '/store/products/?search=alpha&page=2', '/store/products/?search=alpha&cursor=']:
+            self.assert_same_output(url)
+
+    def test_currency(self):
+        for url in ['/store/products/?currency=EUR', '/store/products/?currency=eur&cursor=&ordering=name']:
+            data = self.assert_same_output(url)
+            self.assertEqual(data['results'][0]['currency'], 'EUR')
+
+
+class ORJSONRendererTests(TestCase):
+    def test_matches_json_renderer(self):
+        data = {'id': 1, 'price': Decimal('10.50'), 'name': 'line\u2028separator', 'created': timezone.now(), 'items': [None, True]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_falls_back_to_the_stdlib_encoder(self):
+        data = {'big': 2 ** 70}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class StreamingListTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        user = CustomUser.objects.create_user(username='user', email='user@example.com', password='secret')
+        self.client.force_authenticate(user)
+        customer = user.customer
+        now = timezone.now()
+        for days in [3, 1, 2, 1, 5]:
+            order = Order.objects.create(customer=customer)
+            Order.objects.filter(pk=order.pk).update(datetime_created=now - timedelta(days=days))
+
+    def paged_ids(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids += [row['id'] for row in data['results']]
+            url = data['next']
+        return ids
+
+    def streamed_ids(self, url):
+        response = self.client.get(url)
+        return [row['id'] for row in json.loads(b''.join(response.streaming_content))]
+
+    @mock.patch.object(OrderPagination, 'page_size', 2)
+    def test_orders_stream_in_the_paginated_order(self):
+        self.assertEqual(self.streamed_ids('/store/orders/?stream=true'), self.paged_ids('/store/orders/'))
+
+    def test_products_stream_in_the_paginated_order(self):
+        ProductFactory.create_batch(4, category=self.category)
+        for query in ['', 'ordering=-inventory&']:
+            self.assertEqual(
+                self.streamed_ids(f'/store/products/?{query}stream=true'),
+                self.paged_ids(f'/store/products/?{query}cursor='),
+            )
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = CategoryFactory()
+        ProductFactory.create_batch(35, category=category, name='Widget')
+        cls.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist(self, query):
+        return self.client.get('/admin/store/product/' + query)
+
+    def test_exact_count_below_the_limit(self):
+        paginator = EstimatedCountPaginator(Product.objects.filter(name='Widget').order_by('id'), 10)
+        self.assertEqual((paginator.count, paginator.count_is_exact, paginator.num_pages), (35, True, 4))
+
+    @mock.patch.object(EstimatedCountPaginator, 'count_limit', 15)
+    def test_pages_past_the_count_limit_stay_reachable(self):
+        response = self.changelist('?q=widget&p=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 10)
+        self.assertContains(response, '15+ products')
+        self.assertContains(response, '?p=4&amp;q=widget')
+        self.assertEqual(len(self.changelist('?q=widget&p=4').context['cl'].result_list), 5)
+
+    def test_search_matches_substrings(self):
+        response = self.changelist('?q=idge')
+        self.assertEqual(response.context['cl'].result_count, 35)
+
+
+class ConditionalGetTests(StoreTestCase):
+    def test_rate_change_counts_as_product_modification(self):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        CurrencyRate.objects.update(datetime_modified=an_hour_ago - timedelta(hours=1))
+        Product.objects.filter(pk=self.product.pk).update(datetime_modified=an_hour_ago)
+        url = f'/store/products/{self.product.id}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        rate = CurrencyRate.objects.get(code='IRR')
+        rate.rate *= 2
+        with self.captureOnCommitCallbacks(execute=True):
+            rate.save()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+
+class CurrencyRatesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.monotonic = mock.patch('store.currencies.time.monotonic', return_value=1000.0).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def irr_rate(self):
+        return get_rates()[RIAL][0]
+
+    @override_settings(STORE_CURRENCY_RATES_MAX_AGE=60)
+    def test_rates_reload_after_max_age(self):
+        rate = self.irr_rate()
+        # A change whose version bump never reached this process's cache.
+        CurrencyRate.objects.filter(code=RIAL).update(rate=rate * 2)
+        self.monotonic.return_value += 59
+        self.assertEqual(self.irr_rate(), rate)
+        self.monotonic.return_value += 1
+        self.assertEqual(self.irr_rate(), rate * 2)
+
+    def test_rate_changes_reload_right_away(self):
+        rate = CurrencyRate.objects.get(code=RIAL)
+        self.irr_rate()
+        rate.rate *= 2
+        with self.captureOnCommitCallbacks(execute=True):
+            rate.save()
+        self.assertEqual(self.irr_rate(), rate.rate)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = CategoryFactory()
+        ProductFactory.create_batch(15, category=category)
+
+    def setUp(self):
+        cache.clear()
+
+    async def assert_same_payload(self, sync_url, async_url):
+        expected = (await self.async_client.get(sync_url)).json()
+        response = await self.async_client.get(async_url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        for link in ['next', 'previous']:
+            if isinstance(data, dict) and data.get(link):
+                data[link] = data[link].replace('/store/async/', '/store/')
+        self.assertEqual(data, expected)
+        # Served again from the response cache.
+        self.assertEqual((await self.async_client.get(async_url)).content, response.content)
+
+    async def test_payloads_match_the_sync_views(self):
+        product = await Product.objects.afirst()
+        await self.assert_same_payload('/store/products/', '/store/async/products/')
+        await self.assert_same_payload('/store/products/?page=2', '/store/async/products/?page=2')
+        await self.assert_same_payload(f'/store/products/{product.id}/', f'/store/async/products/{product.id}/')
+        await self.assert_same_payload('/store/categories/', '/store/async/categories/')
+
+    async def test_other_requests_are_delegated(self):
+        await self.assert_same_payload('/store/products/?ordering=-inventory', '/store/async/products/?ordering=-inventory')
+        response = await self.async_client.get('/store/async/products/?page=9')
+        self.assertEqual(response.status_code, 404)
+
+
+@mock.patch('store.replicas.random.choice', lambda replicas: replicas[-1])
+class ReplicaRoutingTests(TransactionTestCase):
+    # Outside TestCase's transaction, which would pin every read to the primary.
+    databases = {'default', 'replica1', 'replica2'}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(REMOTE_ADDR='192.0.2.1')
+        self.client.force_authenticate(CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='admin'))
+        ProductFactory.create_batch(3, category=CategoryFactory())
+
+    def databases_used(self, request):
+        with ExitStack() as stack:
+            queries = {alias: stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in self.databases}
+            response = request()
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return {alias for alias, captured in queries.items() if len(captured)}
+
+    def test_store_reads_go_to_a_replica(self):
+        self.assertEqual(self.databases_used(lambda: self.client.get('/store/orders/')), {'replica2'})
+
+    def test_streamed_bodies_are_read_from_the_replica(self):
+        self.assertEqual(self.databases_used(lambda: self.client.get('/store/products/export/csv/')), {'replica2'})
+        self.assertEqual(self.databases_used(lambda: self.client.get('/store/orders/?stream=true')), {'replica2'})
+
+    def test_cache_refills_read_the_primary(self):
+        self.assertEqual(self.databases_used(lambda: self.client.get('/store/products/')), {'default'})
+        self.assertEqual(self.databases_used(lambda: self.client.get('/store/products/')), set())
+
+    def test_writes_and_other_views_use_the_primary(self):
+        self.assertEqual(self.databases_used(lambda: self.client.get('/metrics')), set())
+        self.assertEqual(self.databases_used(lambda: self.client.post('/store/carts/')), {'default'})
+
+    def test_clients_stick_to_the_primary_after_writing(self):
+        self.client.post('/store/carts/')
+        self.assertEqual(self.databases_used(lambda: self.client.get('/store/orders/')), {'default'})
+        other_client = APIClient(REMOTE_ADDR='192.0.2.2')
+        other_client.force_authenticate(CustomUser.objects.get(username='admin'))
+        self.assertEqual(self.databases_used(lambda: other_client.get('/store/orders/')), {'replica2'})
+
+    def test_reads_in_a_transaction_use_the_primary(self):
+        router = ReplicaRouter()
+        state = RoutingState()
+        state.replica = 'replica1'
+        token = routing_state.set(state)
+        try:
+            self.assertEqual(router.db_for_read(Product), 'replica1')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Product), 'default')
+            with use_primary():
+                self.assertEqual(router.db_for_read(Product), 'default')
+            self.assertEqual(router.db_for_read(Product), 'replica1')
+            router.db_for_write(Product)
+            self.assertEqual(router.db_for_read(Product), 'default')
+        finally:
+            routing_state.reset(token)
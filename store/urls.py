@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
 
-from . import views
+from . import views, async_views
 
 router = routers.DefaultRouter()
 router.register('products', views.ProductModelViewSet, basename='product')
@@ -18,7 +18,14 @@ cart_item_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 cart_item_router.register('items', views.CartItemModelViewSet, basename='cart-items')
 
 
-urlpatterns = router.urls + products_router.urls + cart_item_router.urls
+# Async catalog reads for ASGI deployments; same payloads as the product and category viewsets.
+async_urlpatterns = [
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/categories/', async_views.category_list, name='async-category-list'),
+]
+
+urlpatterns = router.urls + products_router.urls + cart_item_router.urls + async_urlpatterns
 
 # urlpatterns = [
 # 	path('product/', views.ProductList.as_view(), name='product_list'),
@@ -1,41 +1,78 @@
 from django.shortcuts import get_object_or_404
-from django.db.models import Prefetch
+from django.db.models import Count, Max, Prefetch, Subquery, Sum
 
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.exceptions import NotFound
 from rest_framework import status
 
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Product, Category, Comment, Cart, CartItem, Customer, Order, OrderItem
+from .models import Product, Category, Comment, Customer, Order, OrderItem, ProductCommentStats, CurrencyRate
 from .serializers import (ProductSerializer, CategorySerializer, CommentSerializer, CartSerializer, CartItemSerializer,
                           AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer,
-                          OrderAdminSerializer, OrderCreateSerializer, OrderUpdateSerializer)
+                          OrderAdminSerializer, OrderCreateSerializer, OrderUpdateSerializer, CartSummarySerializer,
+                          ProductCommentStatsSerializer, InsufficientInventory)
 from .filters import ProductFilter
 from .permissions import IsAdminOrReadOnly
-from .paginations import DefaultPagination
-
-from store.signals import order_creation
-
-
-class ProductModelViewSet(ModelViewSet):
+from .paginations import ProductPagination, OrderPagination, CommentPagination
+from .cache import get_category_product_counts, get_customer, get_resource_version, CachedReadMixin, PRODUCTS, CATEGORIES, CURRENCIES
+from .carts import get_cart_store
+from .search import ProductSearchFilter
+from .fast_serializers import ValuesListMixin
+from .renderers import ORJSONMixin, StreamingListMixin
+from .exports import export_orders, export_products
+from .bulk import bulk_save_products, adjust_inventory
+from .conditional import ConditionalGetMixin, ConditionalReadMixin
+
+
+class ProductModelViewSet(ORJSONMixin, ConditionalReadMixin, CachedReadMixin, ValuesListMixin, ModelViewSet):
+    cache_resource = PRODUCTS
     serializer_class = ProductSerializer
     queryset = Product.objects.select_related('category').all()
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ProductSearchFilter]
     # filterset_fields = ['category_id', 'inventory']
     filterset_class = ProductFilter
     ordering_fields = ['name', 'inventory']
-    search_fields = ['name', 'category__title']
-    pagination_class = DefaultPagination
+    pagination_class = ProductPagination
     permission_classes = [IsAdminOrReadOnly]
 
     def get_serializer_context(self):
-        return {'request': self.request}
+        return {'request': self.request, 'currency': self.request.query_params.get('currency', '').upper()}
+
+    def get_validators(self, request, *args, **kwargs):
+        currencies = get_resource_version(CURRENCIES)
+        if self.action == 'list':
+            return (get_resource_version(PRODUCTS), currencies), None
+        # The converted prices move with the rates, so the latest rate change counts as a modification too.
+        latest_rate = CurrencyRate.objects.order_by('-datetime_modified').values('datetime_modified')[:1]
+        try:
+            row = Product.objects.filter(pk=kwargs['pk']).values_list(
+                'datetime_modified', Subquery(latest_rate),
+            ).first()
+        except ValueError:
+            return None
+        if row is None:
+            return None
+        modified = max(value for value in row if value is not None)
+        return (row[0].isoformat(), currencies), modified
+
+    @action(detail=False, url_path='export/(?P<export_format>csv|ndjson)', permission_classes=[IsAdminUser])
+    def export(self, request, export_format):
+        return export_products(self.filter_queryset(self.get_queryset()), export_format)
+
+    @action(detail=False, methods=['POST'], url_path='bulk', permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        return Response(bulk_save_products(request.data))
+
+    @action(detail=False, methods=['POST'], url_path='inventory', permission_classes=[IsAdminUser])
+    def inventory(self, request):
+        return Response(adjust_inventory(request.data))
 
     def destroy(self, request, pk):
         product = get_object_or_404(Product.objects.select_related('category'), pk=pk)
@@ -47,22 +84,47 @@ class ProductModelViewSet(ModelViewSet):
 
 class CommentViewSet(ModelViewSet):
     serializer_class = CommentSerializer
+    pagination_class = CommentPagination
 
     def get_queryset(self):
         product_pk = self.kwargs['product_pk']
-        return Comment.objects.filter(product_id=product_pk).all()
+        return Comment.approved.filter(product_id=product_pk)
 
     def get_serializer_context(self):
         return {'product_pk': self.kwargs['product_pk']}
 
+    @action(detail=False)
+    def stats(self, request, product_pk):
+        stats = ProductCommentStats.objects.filter(product_id=product_pk).first() or ProductCommentStats()
+        return Response(ProductCommentStatsSerializer(stats).data)
 
-class CategoryModelViewSet(ModelViewSet):
+
+class CategoryModelViewSet(ORJSONMixin, ConditionalReadMixin, CachedReadMixin, ModelViewSet):
+    cache_resource = CATEGORIES
     serializer_class = CategorySerializer
-    queryset = Category.objects.prefetch_related('products').all()
+    queryset = Category.objects.all()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['product_counts'] = get_category_product_counts()
+        return context
+
+    def get_validators(self, request, *args, **kwargs):
+        product_counts = get_category_product_counts()
+        if self.action == 'list':
+            versions = Category.objects.aggregate(count=Count('id'), versions=Sum('version'), last_id=Max('id'))
+            return (tuple(versions.values()), sorted(product_counts.items())), None
+        try:
+            version = Category.objects.filter(pk=kwargs['pk']).values_list('version', flat=True).first()
+        except ValueError:
+            return None
+        if version is None:
+            return None
+        return (version, product_counts.get(int(kwargs['pk']), 0)), None
 
     def destroy(self, request, pk):
-        category = get_object_or_404(Category.objects.prefetch_related('products').all(), pk=pk)
-        if category.products.count() > 0:
+        category = get_object_or_404(Category, pk=pk)
+        if category.products.exists():
             return Response({'error': 'Not Allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         category.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -72,7 +134,13 @@ class CartItemModelViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
     def get_queryset(self):
         cart_pk = self.kwargs['cart_pk']
-        return CartItem.objects.select_related('product').filter(cart_id=cart_pk).all()
+        return get_cart_store().list_items(cart_pk)
+
+    def get_object(self):
+        cart_item = get_cart_store().get_item(self.kwargs['cart_pk'], self.kwargs['pk'])
+        if cart_item is None:
+            raise NotFound()
+        return cart_item
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -84,12 +152,46 @@ class CartItemModelViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_pk': self.kwargs['cart_pk']}
 
+    def perform_destroy(self, instance):
+        get_cart_store().delete_item(instance)
 
-class CartModelViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+
+class CartModelViewSet(ConditionalGetMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
     serializer_class = CartSerializer
-    queryset = Cart.objects.prefetch_related('items__product').all()
     lookup_value_regex = '[0-9a-f]{8}\-[0-9a-f]{4}\-[0-9a-f]{4}\-[0-9a-f]{4}\-[0-9a-f]{12}'
 
+    def get_object(self):
+        cart = get_cart_store().get_cart(self.kwargs['pk'])
+        if cart is None:
+            raise NotFound()
+        return cart
+
+    def perform_create(self, serializer):
+        serializer.instance = get_cart_store().create_cart()
+
+    def perform_destroy(self, instance):
+        get_cart_store().delete_cart(instance)
+
+    def get_validators(self, request, *args, **kwargs):
+        # Items show the current product names and prices.
+        version = get_cart_store().get_version(kwargs['pk'])
+        if version is None:
+            return None
+        return (version, get_resource_version(PRODUCTS)), None
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    @action(detail=True, methods=['GET'])
+    def summary(self, request, pk):
+        return self.conditional_response(self.get_summary_response, request, pk=pk)
+
+    def get_summary_response(self, request, pk):
+        summary = get_cart_store().get_summary(pk)
+        if summary is None:
+            raise NotFound()
+        return Response(CartSummarySerializer(summary).data)
+
 
 class CustomerViewSet(ModelViewSet):
     serializer_class = CustomerSerializer
@@ -99,7 +201,7 @@ class CustomerViewSet(ModelViewSet):
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
         their_id = request.user.id
-        customer = Customer.objects.get(user_id=their_id)
+        customer = get_customer(their_id)
         if request.method == 'GET':
             srlz = CustomerSerializer(customer)
             return Response(srlz.data)
@@ -110,14 +212,17 @@ class CustomerViewSet(ModelViewSet):
             return Response(srlz.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ConditionalReadMixin, StreamingListMixin, ModelViewSet):
     serializer_class = OrderSerializer
+    pagination_class = OrderPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status']
     http_method_names = ['get', 'post', 'patch', 'delete', 'options', 'head']
 
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE']:
-            return [IsAdminUser]
-        return [IsAuthenticated]
+        if self.request.method in ['PATCH', 'DELETE'] or self.action == 'export':
+            return [IsAdminUser()]
+        return [IsAuthenticated()]
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -136,17 +241,42 @@ class OrderViewSet(ModelViewSet):
             )
         ).all()
         if self.request.user.is_staff:
-            return qs
+            return qs.select_related('customer__user')
         return qs.filter(customer__user_id=self.request.user.id)
 
+    def get_validators(self, request, *args, **kwargs):
+        # Staff responses embed customer profiles, which carry no version.
+        if request.user.is_staff:
+            return None
+        orders = Order.objects.filter(customer__user_id=request.user.id)
+        if self.action == 'list':
+            versions = self.filter_queryset(orders).aggregate(count=Count('id'), versions=Sum('version'), last_id=Max('id'))
+            parts = tuple(versions.values())
+        else:
+            try:
+                parts = orders.filter(pk=kwargs['pk']).values_list('version', flat=True).first()
+            except ValueError:
+                return None
+            if parts is None:
+                return None
+        # Items show the current product names.
+        return (request.user.id, parts, get_resource_version(PRODUCTS)), None
+
     def create(self, request, *args, **kwargs):
         srlz = OrderCreateSerializer(data=request.data, context={'user_id': self.request.user.id})
         srlz.is_valid(raise_exception=True)
-        created_order = srlz.save()
-
-        order_creation.send_robust(self.__class__, order=created_order)
+        # order_creation receivers run from the outbox (see process_outbox), not in the request.
+        try:
+            created_order = srlz.save()
+        except InsufficientInventory as error:
+            return Response({'inventory': error.shortfalls}, status=status.HTTP_409_CONFLICT)
 
+        created_order = self.get_queryset().get(pk=created_order.pk)
         srlzer = OrderSerializer(created_order)
         return Response(srlzer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, url_path='export/(?P<export_format>csv|ndjson)')
+    def export(self, request, export_format):
+        return export_orders(self.filter_queryset(self.get_queryset()), export_format)
+
 